@@ -0,0 +1,144 @@
+import hashlib
+import math
+from statistics import NormalDist
+
+# Sampling rounds: round r evaluates the items whose sample position falls between the previous
+# fraction and this one, so early rounds are small random samples of every stratum
+ROUND_FRACTIONS = (0.01, 0.02, 0.05, 0.1, 0.2, 0.35, 0.5, 0.75, 1.0)
+
+def sample_position(seed, key):
+    """A uniform pseudo-random number in [0, 1) for an item key, fixed for a given seed"""
+    digest = hashlib.sha256(f"{seed}:{key}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") / 2 ** 64
+
+def finite_population_correction(n, population):
+    """Factor shrinking a sampling interval when n of population items are observed; 0 when all are"""
+    if population is None or population <= 1:
+        return 1.0 if population is None else 0.0
+    return math.sqrt(max(0.0, (population - n) / (population - 1)))
+
+def wilson_interval(wins, n, z, population=None):
+    """Wilson score interval (low, high) for a proportion, or (0, 1) without observations.
+
+    With the population size given, the interval shrinks towards the observed rate as the sample
+    covers more of the population, down to (p, p) once every item is observed.
+    """
+    if n == 0:
+        return 0.0, 1.0
+    p = wins / n
+    denominator = 1 + z * z / n
+    center = (p + z * z / (2 * n)) / denominator
+    half_width = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denominator
+    # Shrink the whole interval around p: the Wilson center's pull towards 1/2 is sampling
+    # uncertainty too, and scaling only the width would leave p outside a fully observed stratum
+    correction = finite_population_correction(n, population)
+    center = p + (center - p) * correction
+    half_width *= correction
+    return max(0.0, center - half_width), min(1.0, center + half_width)
+
+class AdaptiveSampler:
+    """Tracks win rates per stratum and decides which strata still need items.
+
+    A stratum is an item's values for the strata fields, e.g. (datasource, criterion). It stops
+    needing items once it has min_items results and every judge's win rate confidence interval is
+    within ±margin. Results with no winner (a failed judge) do not count for that judge.
+    """
+
+    def __init__(self, judges, strata=("datasource", "criterion"), margin=0.02, confidence=0.95,
+                 min_items=10, seed=0):
+        self.judges = judges
+        self.strata = tuple(strata)
+        self.margin = margin
+        self.confidence = confidence
+        self.z = NormalDist().inv_cdf(0.5 + confidence / 2)
+        self.min_items = min_items
+        self.seed = seed
+        self.population = {}
+        self.stats = {}
+        self.converged_strata = set()
+
+    def stratum(self, item):
+        return tuple(item.get(field, "") for field in self.strata)
+
+    def count(self, item):
+        """Count an item of the selected dataset towards its stratum's population"""
+        stratum = self.stratum(item)
+        self.population[stratum] = self.population.get(stratum, 0) + 1
+
+    def observe(self, item, result):
+        """Add an evaluated item's win results to its stratum"""
+        stats = self.stats.setdefault(self.stratum(item), {
+            "items": 0, **{judge: [0, 0] for judge in self.judges}
+        })
+        stats["items"] += 1
+        for judge in self.judges:
+            win = result.get(judge)
+            if win is not None:
+                stats[judge][0] += int(win)
+                stats[judge][1] += 1
+        if self.converged(self.stratum(item)):
+            self.converged_strata.add(self.stratum(item))
+
+    def interval(self, stratum, judge):
+        wins, n = self.stats.get(stratum, {}).get(judge, (0, 0))
+        return wilson_interval(wins, n, self.z, self.population.get(stratum))
+
+    def converged(self, stratum):
+        """Whether a stratum's win rates are all known to within the margin, or it has no items left"""
+        stats = self.stats.get(stratum)
+        if stats is None:
+            return False
+        if stats["items"] >= self.population.get(stratum, float("inf")):
+            return True
+        if stats["items"] < self.min_items:
+            return False
+        return all((high - low) / 2 <= self.margin
+                   for low, high in (self.interval(stratum, judge) for judge in self.judges))
+
+    def needs(self, item):
+        """Whether an item's stratum still needs results"""
+        return self.stratum(item) not in self.converged_strata
+
+    def done(self):
+        """Whether every stratum of the dataset has converged"""
+        return len(self.converged_strata) >= len(self.population)
+
+    def overall(self, judge):
+        """Population-weighted win rate and its normal-approximation interval over sampled strata"""
+        total = sum(self.population.get(stratum, 0) for stratum in self.stats)
+        rate = variance = 0.0
+        for stratum, stats in self.stats.items():
+            wins, n = stats[judge]
+            if n == 0 or total == 0:
+                continue
+            weight = self.population.get(stratum, 0) / total
+            p = wins / n
+            rate += weight * p
+            # A fully evaluated stratum has no sampling error
+            correction = finite_population_correction(n, self.population.get(stratum, n))
+            variance += weight * weight * p * (1 - p) / n * correction ** 2
+        half_width = self.z * math.sqrt(variance)
+        return rate, max(0.0, rate - half_width), min(1.0, rate + half_width)
+
+    def print_report(self, judge_names):
+        """Print win rates with confidence intervals per stratum and overall"""
+        evaluated = sum(stats["items"] for stats in self.stats.values())
+        population = sum(self.population.values())
+        converged = len(self.converged_strata)
+        print(f"Adaptive sampling: {evaluated} of {population} items evaluated, "
+              f"{converged}/{len(self.population)} strata within ±{self.margin * 100:.1f} points "
+              f"at {self.confidence * 100:.0f}% confidence")
+        for judge in self.judges:
+            rate, low, high = self.overall(judge)
+            print(f"  {judge_names.get(judge, judge)} win rate: {rate * 100:.2f}% [{low * 100:.2f}, {high * 100:.2f}]")
+        for stratum in sorted(self.population):
+            stats = self.stats.get(stratum, {"items": 0})
+            label = " / ".join(str(value)[:40] for value in stratum)
+            rates = []
+            for judge in self.judges:
+                wins, n = stats.get(judge, (0, 0))
+                low, high = self.interval(stratum, judge)
+                rates.append(f"{judge_names.get(judge, judge)} {wins / n * 100 if n else 0:.1f}% "
+                             f"[{low * 100:.1f}, {high * 100:.1f}]")
+            status = "converged" if stratum in self.converged_strata else "open"
+            print(f"  {label}: {stats['items']}/{self.population[stratum]} items, {status}; " + ", ".join(rates))
@@ -0,0 +1,198 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+
+# Provider limits are 100,000 (Anthropic) and 50,000 (OpenAI) requests per batch; stay well below both
+DEFAULT_MAX_REQUESTS_PER_BATCH = 10000
+FINISHED_OPENAI_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+def batch_request_id(provider, request):
+    """Return the custom_id for a judge request: a hash of the provider and the full request parameters"""
+    encoded = json.dumps([provider, request], sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+def write_json_atomic(path, value):
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as f:
+        json.dump(value, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+class BatchRunner:
+    """Runs judge requests through the Anthropic Message Batches and OpenAI Batch APIs.
+
+    Progress is checkpointed to a state file after every step (input files written, each batch
+    submitted, each batch downloaded), so an interrupted run picks up where it left off instead
+    of resubmitting work.
+    """
+
+    def __init__(self, anthropic_client, openai_client, work_dir="results/batches", poll_interval=60,
+                 max_requests_per_batch=DEFAULT_MAX_REQUESTS_PER_BATCH, resume=False):
+        self.anthropic_client = anthropic_client
+        self.openai_client = openai_client
+        self.work_dir = work_dir
+        self.poll_interval = poll_interval
+        self.max_requests_per_batch = max_requests_per_batch
+        self.state_path = os.path.join(work_dir, "state.json")
+        os.makedirs(work_dir, exist_ok=True)
+
+        if resume and os.path.exists(self.state_path):
+            with open(self.state_path, "r") as f:
+                self.state = json.load(f)
+        else:
+            self.state = {"prepared": False, "batches": []}
+
+    def save_state(self):
+        write_json_atomic(self.state_path, self.state)
+
+    def prepare(self, requests):
+        """Write batch input files for (provider, request) pairs, unless a resumed run already did.
+
+        Duplicate requests are sent once. Returns the number of requests written.
+        """
+        if self.state["prepared"]:
+            return sum(batch["request_count"] for batch in self.state["batches"])
+
+        by_provider = {"anthropic": {}, "openai": {}}
+        for provider, request in requests:
+            by_provider[provider][batch_request_id(provider, request)] = request
+
+        batches = []
+        for provider, provider_requests in by_provider.items():
+            ids = list(provider_requests)
+            for start in range(0, len(ids), self.max_requests_per_batch):
+                chunk = ids[start:start + self.max_requests_per_batch]
+                input_file = os.path.join(self.work_dir, f"{provider}_input_{len(batches)}.jsonl")
+                with open(input_file, "w") as f:
+                    for custom_id in chunk:
+                        f.write(json.dumps(self.input_line(provider, custom_id, provider_requests[custom_id]),
+                                           ensure_ascii=False) + "\n")
+                batches.append({
+                    "provider": provider,
+                    "input_file": input_file,
+                    "request_count": len(chunk),
+                    "id": None,
+                    "status": "prepared",
+                    "output_file": None
+                })
+
+        self.state = {"prepared": True, "batches": batches}
+        self.save_state()
+        return sum(batch["request_count"] for batch in batches)
+
+    def input_line(self, provider, custom_id, request):
+        """One line of a batch input file in the provider's format"""
+        if provider == "anthropic":
+            return {"custom_id": custom_id, "params": request}
+        return {"custom_id": custom_id, "method": "POST", "url": "/v1/chat/completions", "body": request}
+
+    async def submit(self):
+        """Submit every prepared batch that does not have a provider batch ID yet"""
+        for batch in self.state["batches"]:
+            if batch["id"] is not None:
+                continue
+            if batch["provider"] == "anthropic":
+                with open(batch["input_file"], "r") as f:
+                    requests = [json.loads(line) for line in f]
+                created = await self.anthropic_client.messages.batches.create(requests=requests)
+            else:
+                with open(batch["input_file"], "rb") as f:
+                    uploaded = await self.openai_client.files.create(file=f, purpose="batch")
+                created = await self.openai_client.batches.create(
+                    input_file_id=uploaded.id,
+                    endpoint="/v1/chat/completions",
+                    completion_window="24h"
+                )
+            batch["id"] = created.id
+            batch["status"] = "submitted"
+            self.save_state()
+            print(f"Submitted {batch['provider']} batch {created.id} ({batch['request_count']} requests)")
+
+    async def wait(self):
+        """Poll submitted batches until all have finished and their outputs are downloaded"""
+        while True:
+            waiting = [batch for batch in self.state["batches"] if batch["status"] != "downloaded"]
+            if not waiting:
+                return
+            for batch in waiting:
+                if batch["provider"] == "anthropic":
+                    await self.poll_anthropic(batch)
+                else:
+                    await self.poll_openai(batch)
+            if any(batch["status"] != "downloaded" for batch in self.state["batches"]):
+                await asyncio.sleep(self.poll_interval)
+
+    async def poll_anthropic(self, batch):
+        remote = await self.anthropic_client.messages.batches.retrieve(batch["id"])
+        if remote.processing_status != "ended":
+            return
+        output_file = os.path.join(self.work_dir, f"anthropic_output_{batch['id']}.jsonl")
+        with open(output_file, "w") as f:
+            async for entry in await self.anthropic_client.messages.batches.results(batch["id"]):
+                line = {"custom_id": entry.custom_id, "text": None, "usage": None, "error": None}
+                if entry.result.type == "succeeded":
+                    message = entry.result.message
+                    line["text"] = message.content[0].text
+                    line["usage"] = message.usage.model_dump() if hasattr(message.usage, "model_dump") else None
+                else:
+                    line["error"] = entry.result.type
+                f.write(json.dumps(line, ensure_ascii=False) + "\n")
+        self.mark_downloaded(batch, output_file)
+
+    async def poll_openai(self, batch):
+        remote = await self.openai_client.batches.retrieve(batch["id"])
+        if remote.status not in FINISHED_OPENAI_STATUSES:
+            return
+        output_file = os.path.join(self.work_dir, f"openai_output_{batch['id']}.jsonl")
+        with open(output_file, "w") as f:
+            if remote.output_file_id:
+                content = await self.openai_client.files.content(remote.output_file_id)
+                for raw_line in content.text.splitlines():
+                    if not raw_line.strip():
+                        continue
+                    entry = json.loads(raw_line)
+                    line = {"custom_id": entry["custom_id"], "text": None, "usage": None, "error": None}
+                    response = entry.get("response") or {}
+                    if response.get("status_code") == 200:
+                        body = response["body"]
+                        line["text"] = body["choices"][0]["message"]["content"]
+                        line["usage"] = body.get("usage")
+                    else:
+                        line["error"] = entry.get("error") or f"status {response.get('status_code')}"
+                    f.write(json.dumps(line, ensure_ascii=False) + "\n")
+        self.mark_downloaded(batch, output_file, remote.status)
+
+    def mark_downloaded(self, batch, output_file, remote_status="ended"):
+        batch["output_file"] = output_file
+        batch["status"] = "downloaded"
+        batch["remote_status"] = remote_status
+        self.save_state()
+        print(f"Downloaded {batch['provider']} batch {batch['id']} ({remote_status})")
+
+    def outputs(self):
+        """Return {custom_id: (provider, text, usage)} for every succeeded request in downloaded batches"""
+        outputs = {}
+        for batch in self.state["batches"]:
+            if batch["output_file"] is None:
+                continue
+            with open(batch["output_file"], "r") as f:
+                for line in f:
+                    entry = json.loads(line)
+                    if entry["text"] is not None:
+                        outputs[entry["custom_id"]] = (batch["provider"], entry["text"], entry["usage"])
+        return outputs
+
+    async def run(self, requests):
+        """Prepare, submit and wait for batches; return the collected outputs"""
+        start = time.monotonic()
+        count = self.prepare(requests)
+        if count == 0:
+            return {}
+        await self.submit()
+        await self.wait()
+        outputs = self.outputs()
+        print(f"Batch engine: {len(outputs)}/{count} requests succeeded in {time.monotonic() - start:.0f}s")
+        return outputs
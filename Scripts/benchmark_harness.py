@@ -0,0 +1,213 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import socket
+import subprocess
+import sys
+import time
+import aiohttp
+from evaluate import EvalRunner
+
+# Benchmark: throughput and overhead of the evaluation harness itself. Runs evaluate.py's
+# EvalRunner against the local stand-in providers (mock_providers.py, started in a separate
+# process so its CPU time is not counted) at several concurrency levels.
+
+MOCK_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mock_providers.py")
+DATASOURCES = ("FINQA", "XSUM", "PubMed", "TechQA")
+CRITERIA = (
+    "Reward responses that provide a concise, direct answer to the user message without superfluous explanation or detail.",
+    "Reward responses that strictly use only information present in the provided context paragraphs without adding external knowledge",
+    "Reward responses that use correct and accurate technical terminologies appropriate to an expert audience, instead of explaining basic concepts."
+)
+
+def make_items(count, prompts=29, seed=0):
+    """Synthetic dataset items with realistic text sizes, sharing `prompts` distinct contexts"""
+    rng = random.Random(seed)
+    words = ["revenue", "margin", "summary", "context", "question", "answer", "growth", "report", "patient",
+             "result", "system", "error", "value", "percent", "quarter", "study", "model", "server"]
+
+    def text(length):
+        return " ".join(rng.choice(words) for _ in range(length))
+
+    contexts = [f"###User question\nUser question: {text(20)}?\n\n###Context\n{text(600)}" for _ in range(prompts)]
+    return [{
+        "prompt": contexts[index % prompts],
+        "criterion": CRITERIA[index % len(CRITERIA)],
+        "chosen": text(rng.randint(40, 120)),
+        "rejected": text(rng.randint(40, 120)),
+        "datasource": DATASOURCES[index % len(DATASOURCES)]
+    } for index in range(count)]
+
+def benchmark_config(url, concurrency, judging, extra_judges=0, stream=True):
+    """An evaluation config pointing every provider at the stand-in server, with extra_judges more
+    LLM judges (alternately Claude and OpenAI type, each with its own concurrency like separately
+    rate-limited models) next to the built-in ones"""
+    evaluators = {name: {"stream": stream} for name in ("claude", "openai", "claude_pairwise", "openai_pairwise")}
+    for number in range(1, extra_judges + 1):
+        evaluators[f"judge_{number}"] = {"type": "anthropic" if number % 2 else "openai", "model": f"stand-in-{number}",
+                                         "display_name": f"Judge {number}", "stream": stream,
+                                         "concurrency": 2 * concurrency}
+    return {
+        "api_keys": {"anthropic": "stand-in", "openai": "stand-in"},
+        "api": {"key": "stand-in", "url": f"{url}/api/v1/evals/reward"},
+        "model": {
+            "model_name": "gpt-4.1",
+            "anthropic_model": "claude-sonnet-4-20250514",
+            "temperature": 0,
+            "max_tokens": 500,
+            "anthropic_base_url": url,
+            "openai_base_url": f"{url}/v1"
+        },
+        "concurrency": {"items": concurrency, "composo": 2 * concurrency, "anthropic": 2 * concurrency,
+                        "openai": 2 * concurrency},
+        "judging": {"mode": judging},
+        "evaluators": evaluators,
+        "retry": {"max_retries": 5, "base_delay": 0.05, "max_delay": 1},
+        "response_cache": {"enabled": False},
+        "metrics": {"enabled": False}
+    }
+
+def free_port(host):
+    with socket.socket() as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+async def start_mock(host, mock_args):
+    """Start mock_providers.py in a subprocess and return (process, base URL) once it answers"""
+    port = free_port(host)
+    process = subprocess.Popen([sys.executable, MOCK_SCRIPT, "--host", host, "--port", str(port), *mock_args],
+                               stdout=subprocess.DEVNULL)
+    url = f"http://{host}:{port}"
+    async with aiohttp.ClientSession() as session:
+        for _ in range(100):
+            if process.poll() is not None:
+                raise RuntimeError(f"Stand-in server exited with code {process.returncode}")
+            try:
+                async with session.get(f"{url}/mock/stats") as response:
+                    if response.status == 200:
+                        return process, url
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("Stand-in server did not start")
+
+async def server_stats(url):
+    async with aiohttp.ClientSession() as session:
+        async with session.get(f"{url}/mock/stats") as response:
+            return await response.json()
+
+def rss_mb():
+    """Current resident memory of this process in MB (peak memory where /proc is not available)"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError):
+        return peak_rss_mb()
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+async def run_level(url, items, concurrency, judging, extra_judges=0, stream=True):
+    """Evaluate all items at one concurrency level and return its measurements"""
+    runner = EvalRunner(benchmark_config(url, concurrency, judging, extra_judges, stream), use_cache=False,
+                        write_results=False, verbose=False)
+    before = await server_stats(url)
+    cpu_started = time.process_time()
+    started = time.perf_counter()
+    results = await runner.run(items)
+    wall = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+    after = await server_stats(url)
+
+    def delta(name):
+        return sum(after[provider].get(name, 0) - before[provider].get(name, 0) for provider in after)
+
+    calls = delta("requests")
+    failed = sum(1 for result in results if any(result.get(field) is None for field in result if field.endswith("_win")))
+    return {
+        "concurrency": concurrency,
+        "items": len(results),
+        "wall": wall,
+        "items_per_second": len(results) / wall,
+        "calls": calls,
+        "calls_per_second": calls / wall,
+        "cpu_ms_per_call": cpu / calls * 1000 if calls else None,
+        "rate_limited": delta("429"),
+        "server_errors": delta("500"),
+        "malformed": delta("malformed"),
+        "items_with_failed_judge": failed,
+        "rss_mb": rss_mb(),
+        "peak_rss_mb": peak_rss_mb()
+    }
+
+def print_level(level, baseline=None):
+    cpu = f"{level['cpu_ms_per_call']:.2f}" if level["cpu_ms_per_call"] is not None else "-"
+    line = (f"{level['concurrency']:>11}  {level['items_per_second']:>9.1f}  {level['calls_per_second']:>9.1f}  "
+            f"{cpu:>11}  {level['rss_mb']:>7.0f}  {level['peak_rss_mb']:>8.0f}  "
+            f"{level['rate_limited']:>5}  {level['server_errors']:>5}  {level['malformed']:>9}  "
+            f"{level['items_with_failed_judge']:>6}")
+    if baseline is not None:
+        line += f"  items/s {(level['items_per_second'] / baseline['items_per_second'] - 1) * 100:+.1f}%"
+        if level["cpu_ms_per_call"] and baseline["cpu_ms_per_call"]:
+            line += f", cpu/call {(level['cpu_ms_per_call'] / baseline['cpu_ms_per_call'] - 1) * 100:+.1f}%"
+    print(line)
+
+async def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark evaluate.py against local stand-in providers at several concurrency levels. "
+                    "Other options (e.g. --latency-median, --rate-limit-rate, --malformed-rate) are passed "
+                    "to mock_providers.py.")
+    parser.add_argument("--items", type=int, default=200, help="Items evaluated per concurrency level")
+    parser.add_argument("--concurrency", default="1,8,32", help="Comma-separated items-in-flight levels")
+    parser.add_argument("--judging", choices=("pointwise", "pairwise", "both"), default="pointwise")
+    parser.add_argument("--extra-judges", type=int, default=0,
+                        help="LLM judges to add next to the built-in ones, to measure how latency scales with judges")
+    parser.add_argument("--no-stream", action="store_true", help="Read LLM judge responses whole instead of streaming")
+    parser.add_argument("--dataset", help="Evaluate the first --items items of a dataset file instead of synthetic ones")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--json", help="Write the measurements to this file")
+    parser.add_argument("--baseline", help="Measurements file of an earlier benchmark to compare against")
+    args, mock_args = parser.parse_known_args()
+
+    if args.dataset:
+        from dataset_reader import iter_items
+        items = list(iter_items(args.dataset, max_items=args.items))
+    else:
+        items = make_items(args.items)
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = {level["concurrency"]: level for level in json.load(f)["levels"]}
+
+    process, url = await start_mock(args.host, mock_args)
+    print(f"Stand-in providers at {url} {' '.join(mock_args)}".rstrip())
+    print(f"{len(items)} items per level, {args.judging} judging, {args.extra_judges} extra judges, "
+          f"{'whole' if args.no_stream else 'streamed'} responses")
+    print(f"{'concurrency':>11}  {'items/s':>9}  {'calls/s':>9}  {'cpu ms/call':>11}  {'rss MB':>7}  {'peak MB':>8}  "
+          f"{'429s':>5}  {'500s':>5}  {'malformed':>9}  {'failed':>6}")
+    levels = []
+    try:
+        # Warm up: import the SDKs and open the first connections outside the measurements
+        await run_level(url, items[:8], 4, args.judging, args.extra_judges, not args.no_stream)
+        for concurrency in (int(level) for level in args.concurrency.split(",")):
+            level = await run_level(url, items, concurrency, args.judging, args.extra_judges, not args.no_stream)
+            levels.append(level)
+            print_level(level, baseline.get(concurrency))
+    finally:
+        process.terminate()
+        process.wait()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"items": len(items), "judging": args.judging, "extra_judges": args.extra_judges,
+                       "stream": not args.no_stream, "mock_args": mock_args, "levels": levels}, f, indent=2)
+        print(f"Measurements written to {args.json}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
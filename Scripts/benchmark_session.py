@@ -0,0 +1,114 @@
+import argparse
+import asyncio
+import statistics
+import time
+import aiohttp
+from aiohttp import web
+from http_session import create_session
+
+# Benchmark: per-call latency of a new ClientSession per Composo call vs one shared pooled session.
+# Runs against a local stand-in for the Composo reward endpoint, so no API key or network is needed.
+
+async def reward_handler(request):
+    """Stand-in for the Composo reward endpoint"""
+    await request.json()
+    delay = request.app["delay"]
+    if delay > 0:
+        await asyncio.sleep(delay)
+    return web.json_response({"score": 0.5, "explanation": "Local stand-in response."})
+
+async def start_server(host, port, delay):
+    """Start the local stand-in server and return its runner and URL"""
+    app = web.Application()
+    app["delay"] = delay
+    app.router.add_post("/api/v1/evals/reward", reward_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{port}/api/v1/evals/reward"
+
+def build_payload():
+    return {
+        "messages": [
+            {"role": "user", "content": "Question and context " * 100},
+            {"role": "assistant", "content": "Answer " * 50}
+        ],
+        "evaluation_criteria": "Reward responses that are concise."
+    }
+
+async def post_once(session, url, payload):
+    """Send one request and return its latency in seconds"""
+    start = time.perf_counter()
+    async with session.post(url, json=payload) as response:
+        await response.json()
+    return time.perf_counter() - start
+
+async def run_fresh_sessions(url, calls, concurrency):
+    """Open a new ClientSession for every call, as evaluate_with_composo used to"""
+    semaphore = asyncio.Semaphore(concurrency)
+    payload = build_payload()
+
+    async def call():
+        async with semaphore:
+            start = time.perf_counter()
+            async with aiohttp.ClientSession() as session:
+                async with session.post(url, json=payload) as response:
+                    await response.json()
+            return time.perf_counter() - start
+
+    return await asyncio.gather(*(call() for _ in range(calls)))
+
+async def run_shared_session(url, calls, concurrency, http_config):
+    """Reuse one pooled session for every call"""
+    semaphore = asyncio.Semaphore(concurrency)
+    payload = build_payload()
+    session = create_session(http_config)
+
+    async def call():
+        async with semaphore:
+            return await post_once(session, url, payload)
+
+    try:
+        return await asyncio.gather(*(call() for _ in range(calls)))
+    finally:
+        await session.close()
+
+def summarize(name, latencies, wall_time):
+    ordered = sorted(latencies)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    print(f"{name}: mean {statistics.mean(ordered) * 1000:.2f} ms, "
+          f"p50 {statistics.median(ordered) * 1000:.2f} ms, p95 {p95 * 1000:.2f} ms, "
+          f"wall {wall_time:.2f} s ({len(ordered) / wall_time:.1f} calls/s)")
+    return statistics.mean(ordered)
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark shared vs per-call Composo HTTP sessions")
+    parser.add_argument("--calls", type=int, default=800, help="Number of Composo calls to simulate")
+    parser.add_argument("--concurrency", type=int, default=16, help="Calls in flight at once")
+    parser.add_argument("--delay", type=float, default=0.0, help="Simulated server processing time in seconds")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0, help="Port for the stand-in server (0 picks a free port)")
+    args = parser.parse_args()
+
+    runner, url = await start_server(args.host, args.port, args.delay)
+    print(f"Stand-in Composo server at {url}")
+    print(f"{args.calls} calls, {args.concurrency} in flight, {args.delay * 1000:.0f} ms server delay")
+    try:
+        start = time.perf_counter()
+        fresh = await run_fresh_sessions(url, args.calls, args.concurrency)
+        fresh_mean = summarize("New session per call", fresh, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        shared = await run_shared_session(url, args.calls, args.concurrency, {"pool_size": args.concurrency})
+        shared_mean = summarize("Shared pooled session", shared, time.perf_counter() - start)
+
+        print(f"Saved per call: {(fresh_mean - shared_mean) * 1000:.2f} ms")
+        print("Note: the stand-in is plain HTTP on loopback; against platform.composo.ai each "
+              "new session also pays DNS resolution, network round trips and a TLS handshake.")
+    finally:
+        await runner.cleanup()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,261 @@
+import argparse
+import json
+import os
+import time
+
+# Estimated USD per million tokens; config "pricing" entries override or extend these. A model
+# uses the entry with the longest name that its own name starts with.
+DEFAULT_PRICING = {
+    "claude-3-7-sonnet": {"input": 3.0, "output": 15.0, "cache_read": 0.30, "cache_write": 3.75},
+    "claude-sonnet-4": {"input": 3.0, "output": 15.0, "cache_read": 0.30, "cache_write": 3.75},
+    "claude-3-5-haiku": {"input": 0.80, "output": 4.0, "cache_read": 0.08, "cache_write": 1.0},
+    "gpt-4.1": {"input": 2.0, "output": 8.0, "cache_read": 0.50},
+    "gpt-4.1-mini": {"input": 0.40, "output": 1.60, "cache_read": 0.10},
+    "gpt-4o": {"input": 2.50, "output": 10.0, "cache_read": 1.25},
+}
+# Batch APIs bill half the interactive price
+BATCH_DISCOUNT = 0.5
+
+def percentile(values, q):
+    """Linearly interpolated q-th percentile (0-100) of a list of numbers, or None if empty"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+def model_price(pricing, model):
+    """Return the price entry for a model, or None if it is unknown"""
+    matches = [name for name in pricing if model == name or model.startswith(name)]
+    return pricing[max(matches, key=len)] if matches else None
+
+def estimate_cost(pricing, model, tokens, batch=False):
+    """Estimated USD cost of one call's tokens, or None when the model has no price.
+
+    tokens uses the run's token usage keys: "uncached" input (including cache writes),
+    "cache_read", "cache_write" and "output". A "per_call" price is added as is.
+    """
+    price = model_price(pricing, model)
+    if price is None:
+        return None
+    cost = ((tokens["uncached"] - tokens["cache_write"]) * price.get("input", 0)
+            + tokens["cache_write"] * price.get("cache_write", price.get("input", 0))
+            + tokens["cache_read"] * price.get("cache_read", price.get("input", 0))
+            + tokens["output"] * price.get("output", 0)) / 1_000_000
+    if batch:
+        cost *= BATCH_DISCOUNT
+    return cost + price.get("per_call", 0)
+
+class CallTiming:
+    """Timing and token counts of one evaluator call, accumulated over all of its attempts"""
+
+    def __init__(self, evaluator, provider, model):
+        self.evaluator = evaluator
+        self.provider = provider
+        self.model = model
+        self.started = time.monotonic()
+        self.queue_wait = 0.0
+        self.ttfb = None
+        self.finished = None
+        # Called when a request of the call is sent, e.g. to start a hedge clock
+        self.on_sent = None
+        self.tokens = {"uncached": 0, "cache_read": 0, "cache_write": 0, "output": 0}
+        # Counts of responses whose usage never arrived (a stream cut off), kept apart from real counts
+        self.estimated_tokens = {"uncached": 0, "cache_read": 0, "cache_write": 0, "output": 0}
+        # Background reads of streamed responses that still add their token usage
+        self.tails = []
+
+    def queued(self, since):
+        """Count the time since `since` as waiting for a concurrency slot; return the current time,
+        when the request is sent"""
+        now = time.monotonic()
+        self.queue_wait += now - since
+        if self.on_sent is not None:
+            self.on_sent()
+        return now
+
+    def first_byte(self, sent):
+        """Record the time from sending a request to its response headers (the last attempt wins)"""
+        self.ttfb = time.monotonic() - sent
+
+    def finish(self):
+        """Stop the call's latency clock; usage from stream tails may still arrive"""
+        if self.finished is None:
+            self.finished = time.monotonic()
+
+    def add_tokens(self, counts, estimated=False):
+        tokens = self.estimated_tokens if estimated else self.tokens
+        for name, count in counts.items():
+            tokens[name] += count
+
+    def record(self, source, attempts=0, rate_limit_wait=0.0, failed=False, pricing=None):
+        """The metrics record for this call; source is "api", "cache", "batch" or "hedge" (the
+        duplicate request of a hedged call, recorded next to the call itself)"""
+        cost = None
+        if pricing is not None and source != "cache":
+            tokens = {name: count + self.estimated_tokens[name] for name, count in self.tokens.items()}
+            cost = estimate_cost(pricing, self.model, tokens, batch=source == "batch")
+        return {
+            "type": "call",
+            "evaluator": self.evaluator,
+            "provider": self.provider,
+            "model": self.model,
+            "source": source,
+            "status": "failed" if failed else "ok",
+            "attempts": attempts,
+            "queue_wait": round(self.queue_wait + rate_limit_wait, 4),
+            "ttfb": round(self.ttfb, 4) if self.ttfb is not None else None,
+            "latency": round((self.finished or time.monotonic()) - self.started, 4),
+            "tokens": dict(self.tokens),
+            "estimated_tokens": dict(self.estimated_tokens),
+            "cost": cost
+        }
+
+class MetricsSummary:
+    """Running aggregate of metrics records: per-evaluator latency distributions and totals,
+    and how often each judge was the last to finish an item (its critical path)"""
+
+    def __init__(self):
+        self.evaluators = {}
+        self.item_durations = []
+        self.critical = {}
+
+    def add(self, record):
+        if record["type"] == "item":
+            self.item_durations.append(record["duration"])
+            self.critical[record["critical"]] = self.critical.get(record["critical"], 0) + 1
+            return
+        stats = self.evaluators.setdefault(record["evaluator"], {
+            "model": record["model"], "api": 0, "cache": 0, "batch": 0, "hedge": 0, "failed": 0, "attempts": 0,
+            "latency": [], "queue_wait": [], "ttfb": [],
+            "tokens": {"uncached": 0, "cache_read": 0, "cache_write": 0, "output": 0},
+            "estimated_tokens": {"uncached": 0, "cache_read": 0, "cache_write": 0, "output": 0}, "cost": 0.0, "priced": True
+        })
+        stats[record["source"]] += 1
+        # Hedges add requests, tokens and cost, but the call they duplicate is counted and timed itself
+        if record["source"] != "hedge":
+            if record["status"] == "failed":
+                stats["failed"] += 1
+            stats["attempts"] += record["attempts"]
+        if record["source"] == "api":
+            # Cache hits and batch outputs return immediately and would hide the real call latency
+            stats["latency"].append(record["latency"])
+            stats["queue_wait"].append(record["queue_wait"])
+            if record["ttfb"] is not None:
+                stats["ttfb"].append(record["ttfb"])
+        for name, count in record["tokens"].items():
+            stats["tokens"][name] += count
+        # Records written before estimated counts were kept apart have none
+        for name, count in record.get("estimated_tokens", {}).items():
+            stats["estimated_tokens"][name] += count
+        if record["cost"] is None and record["source"] != "cache":
+            stats["priced"] = False
+        stats["cost"] += record["cost"] or 0.0
+
+    def as_dict(self):
+        """Summary with p50/p95/p99 per evaluator, in seconds"""
+        evaluators = {}
+        for evaluator, stats in sorted(self.evaluators.items()):
+            evaluators[evaluator] = {
+                "model": stats["model"],
+                "calls": {"api": stats["api"], "cache": stats["cache"], "batch": stats["batch"], "hedge": stats["hedge"]},
+                "failed": stats["failed"],
+                "attempts_per_call": stats["attempts"] / stats["api"] if stats["api"] else 0,
+                **{f"{name}_p{q}": percentile(stats[name], q)
+                   for name in ("latency", "queue_wait", "ttfb") for q in (50, 95, 99)},
+                "tokens": stats["tokens"],
+                "estimated_tokens": stats["estimated_tokens"],
+                "cost": stats["cost"] if stats["priced"] else None
+            }
+        items = len(self.item_durations)
+        return {
+            "evaluators": evaluators,
+            "items": items,
+            "item_p50": percentile(self.item_durations, 50),
+            "item_p99": percentile(self.item_durations, 99),
+            "critical_path": {evaluator: count / items for evaluator, count in
+                              sorted(self.critical.items(), key=lambda entry: -entry[1])} if items else {}
+        }
+
+def seconds(value):
+    return f"{value:.2f}s" if value is not None else "-"
+
+def print_profile(summary, baseline=None):
+    """Print a run profile, with p99 changes against a baseline summary if given"""
+    print("Run profile (live API calls; cache hits and batch outputs are counted but not timed):")
+    for evaluator, stats in summary["evaluators"].items():
+        calls = stats["calls"]
+        cost = f"${stats['cost']:.4f}" if stats["cost"] is not None else "cost unknown"
+        hedges = f", {calls['hedge']} hedges" if calls.get("hedge") else ""
+        print(f"  {evaluator} ({stats['model']}): {calls['api']} api, {calls['cache']} cache, {calls['batch']} batch"
+              f"{hedges}, {stats['failed']} failed, {stats['attempts_per_call']:.2f} attempts/call, {cost}")
+        if not calls["api"]:
+            continue
+        line = "    "
+        for name, label in (("latency", "latency"), ("ttfb", "ttfb"), ("queue_wait", "queue wait")):
+            line += (f"{label} p50/p95/p99 {seconds(stats[f'{name}_p50'])}/{seconds(stats[f'{name}_p95'])}/"
+                     f"{seconds(stats[f'{name}_p99'])}  ")
+        print(line.rstrip())
+        if baseline is not None and evaluator in baseline["evaluators"]:
+            before = baseline["evaluators"][evaluator]["latency_p99"]
+            after = stats["latency_p99"]
+            if before and after is not None:
+                print(f"    p99 latency vs baseline: {seconds(before)} -> {seconds(after)} ({(after - before) / before * 100:+.1f}%)")
+        tokens = stats["tokens"]
+        if any(tokens.values()):
+            print(f"    tokens: {tokens['uncached']} uncached input, {tokens['cache_read']} cached input, "
+                  f"{tokens['output']} output")
+        estimated = stats["estimated_tokens"]
+        if any(estimated.values()):
+            print(f"    estimated tokens of responses without usage: {estimated['uncached']} input, "
+                  f"{estimated['output']} output")
+    if summary["items"]:
+        print(f"  Items: {summary['items']}, duration p50/p99 {seconds(summary['item_p50'])}/{seconds(summary['item_p99'])}")
+        critical = ", ".join(f"{evaluator} {share * 100:.0f}%" for evaluator, share in summary["critical_path"].items())
+        print(f"  Critical path (slowest judge per item): {critical}")
+
+class MetricsLog:
+    """JSONL file of per-call and per-item metrics records, with a running summary"""
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.summary = MetricsSummary()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(path, "a" if resume else "w")
+
+    def write(self, record):
+        self.summary.add(record)
+        self.file.write(json.dumps(record) + "\n")
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+def summarize_file(path):
+    """Summarize a metrics file"""
+    summary = MetricsSummary()
+    with open(path, "r") as f:
+        for line in f:
+            if line.strip():
+                summary.add(json.loads(line))
+    return summary.as_dict()
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize the per-call metrics of an evaluation run")
+    parser.add_argument("metrics_file", nargs="?", default="results/metrics.jsonl")
+    parser.add_argument("--baseline", help="Metrics file of an earlier run to compare p99 latency against")
+    parser.add_argument("--json", action="store_true", help="Print the summary as JSON")
+    args = parser.parse_args()
+
+    summary = summarize_file(args.metrics_file)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+    print_profile(summary, summarize_file(args.baseline) if args.baseline else None)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import itertools
+import json
+
+# Characters read from a JSON array dataset at a time
+READ_CHUNK_SIZE = 1024 * 1024
+
+def detect_format(path):
+    """Return "array" for a JSON array dataset or "jsonl" for one item per line"""
+    with open(path, "r", encoding="utf-8-sig") as f:
+        while True:
+            chunk = f.read(4096)
+            if not chunk:
+                return "jsonl"
+            stripped = chunk.lstrip()
+            if stripped:
+                return "array" if stripped[0] == "[" else "jsonl"
+
+def iter_jsonl(path):
+    """Yield the items of a JSONL dataset, skipping blank lines"""
+    with open(path, "r", encoding="utf-8-sig") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"{path}:{line_number}: invalid JSON: {e}") from None
+
+def iter_json_array(path, chunk_size=READ_CHUNK_SIZE):
+    """Yield the elements of a top-level JSON array one at a time.
+
+    The file is read in chunks and each element is decoded as soon as it is complete, so memory
+    use is bounded by the chunk size and the largest single item, not by the file size.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8-sig") as f:
+        buffer = f.read(chunk_size).lstrip()
+        if not buffer.startswith("["):
+            raise ValueError(f"{path}: expected a JSON array")
+        position = 1
+        eof = False
+        while True:
+            # Skip whitespace and the separator before the next element
+            while position < len(buffer) and buffer[position] in " \t\r\n,":
+                position += 1
+            if position < len(buffer) and buffer[position] == "]":
+                return
+            if position < len(buffer):
+                try:
+                    item, end = decoder.raw_decode(buffer, position)
+                except ValueError:
+                    # The element continues in the next chunk, unless the file has ended
+                    if eof:
+                        raise ValueError(f"{path}: invalid JSON array element at character {position}") from None
+                else:
+                    position = end
+                    yield item
+                    continue
+            elif eof:
+                raise ValueError(f"{path}: unterminated JSON array")
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            # Drop consumed text only when reading more, so decoding an item never copies the buffer
+            buffer = buffer[position:] + chunk
+            position = 0
+
+def item_filter(datasources=None, criteria=None):
+    """Return a predicate for the datasource and criterion filters.
+
+    datasources are matched exactly (ignoring case), criteria as case-insensitive substrings of
+    the item's criterion. An empty or missing filter matches every item.
+    """
+    datasources = {datasource.lower() for datasource in datasources or []}
+    criteria = [criterion.lower() for criterion in criteria or []]
+
+    def matches(item):
+        if datasources and item.get("datasource", "").lower() not in datasources:
+            return False
+        if criteria:
+            criterion = item.get("criterion", "").lower()
+            return any(c in criterion for c in criteria)
+        return True
+    return matches
+
+def iter_items(path, offset=0, max_items=0, datasources=None, criteria=None):
+    """Stream the items of a JSON array or JSONL dataset.
+
+    Filters are applied first; offset and max_items (0 = no limit) then count matching items.
+    """
+    reader = iter_json_array(path) if detect_format(path) == "array" else iter_jsonl(path)
+    items = filter(item_filter(datasources, criteria), reader)
+    return itertools.islice(items, offset, offset + max_items if max_items > 0 else None)
+
+class Dataset:
+    """A re-iterable, streaming view of a dataset file: every iteration reads the file again"""
+
+    def __init__(self, path, offset=0, max_items=0, datasources=None, criteria=None):
+        self.path = path
+        self.offset = offset
+        self.max_items = max_items
+        self.datasources = datasources or []
+        self.criteria = criteria or []
+
+    def __iter__(self):
+        return iter_items(self.path, self.offset, self.max_items, self.datasources, self.criteria)
@@ -0,0 +1,125 @@
+import asyncio
+import bisect
+import time
+from collections import deque
+from call_metrics import percentile
+
+class HedgePolicy:
+    """Sends a duplicate request when a call is slower than a learned latency percentile.
+
+    The hedge delay is the chosen percentile of the last `window` primary request latencies, timed
+    from when a request is sent, so time queued for a call slot neither teaches nor triggers it. No
+    hedge is sent until `min_samples` latencies are known, and hedges are capped at
+    `max_extra_requests` times the number of calls. Whichever request answers first wins and the
+    other is cancelled. Only primary requests teach the delay: a hedge answers sooner than its
+    primary would have, so learning from it would lower the delay and hedge ever more often.
+    """
+
+    def __init__(self, percentile=95, max_extra_requests=0.05, min_samples=20, window=500):
+        self.percentile = percentile
+        self.max_extra_requests = max_extra_requests
+        self.min_samples = min_samples
+        self.recent = deque(maxlen=window)
+        self.calls = 0
+        self.fired = 0
+        self.won = 0
+        # Latency each call was delivered in, latencies of primaries that finished, and how long
+        # the primaries of calls won by a hedge had run when they were cancelled
+        self.delivered = []
+        self.completed = []
+        self.cancelled = []
+
+    def hedge_delay(self):
+        """Seconds to wait before hedging, or None while too few latencies are known"""
+        if len(self.recent) < self.min_samples:
+            return None
+        return percentile(list(self.recent), self.percentile)
+
+    def can_hedge(self):
+        return self.fired < self.max_extra_requests * self.calls
+
+    def observe(self, latency, primary_finished=True):
+        self.delivered.append(latency)
+        if primary_finished:
+            self.completed.append(latency)
+            self.recent.append(latency)
+        else:
+            # The primary was cancelled after `latency`; learn its estimated full latency instead
+            self.cancelled.append(latency)
+            longer = [recent for recent in self.recent if recent > latency]
+            self.recent.append(sum(longer) / len(longer) if longer else latency)
+
+    def unhedged_latencies(self):
+        """Estimated latencies without hedging.
+
+        A cancelled primary is assumed to take the mean latency of the finished primaries that
+        ran longer than it had when it was cancelled, or the time it had run if there are none.
+        """
+        tail = sorted(self.completed)
+        # Suffix sums of the sorted latencies give the mean of those above any cut-off
+        suffix = [0.0] * (len(tail) + 1)
+        for index in range(len(tail) - 1, -1, -1):
+            suffix[index] = suffix[index + 1] + tail[index]
+        estimates = list(self.completed)
+        for elapsed in self.cancelled:
+            start = bisect.bisect_right(tail, elapsed)
+            longer = len(tail) - start
+            estimates.append(suffix[start] / longer if longer else elapsed)
+        return estimates
+
+    async def run(self, request, hedge_request=None, allowed=None, sent=None):
+        """Await request(), hedging it with hedge_request() (by default request()) if it is slow.
+
+        allowed() can veto a hedge that is due, e.g. once a request budget is spent. sent is an
+        asyncio.Event that request() sets once its request is sent; the hedge clock starts then.
+        """
+        hedge_request = hedge_request or request
+        self.calls += 1
+        primary = asyncio.ensure_future(request())
+        pending = {primary}
+        try:
+            if sent is not None:
+                waiter = asyncio.ensure_future(sent.wait())
+                try:
+                    await asyncio.wait({primary, waiter}, return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    waiter.cancel()
+            started = time.monotonic()
+            delay = self.hedge_delay()
+            if delay is not None:
+                await asyncio.wait(pending, timeout=delay)
+            if primary.done() or delay is None or not self.can_hedge() or (allowed is not None and not allowed()):
+                result = await primary
+                self.observe(time.monotonic() - started)
+                return result
+
+            self.fired += 1
+            hedge = asyncio.ensure_future(hedge_request())
+            pending.add(hedge)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                # Prefer the primary when both finish together, and ignore a failed request while
+                # the other one may still succeed
+                for task in sorted(done, key=lambda task: task is not primary):
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.won += 1
+                        self.observe(time.monotonic() - started, primary_finished=task is primary)
+                        return task.result()
+            raise primary.exception()
+        finally:
+            # Cancel the losing request, or both when the caller itself is cancelled
+            for task in pending:
+                if not task.done():
+                    task.cancel()
+
+    def report(self):
+        """Hedging counts and the p99 latency with hedges and, estimated, without"""
+        return {
+            "calls": self.calls,
+            "hedges": self.fired,
+            "hedges_won": self.won,
+            "delay": self.hedge_delay(),
+            "p99": percentile(self.delivered, 99),
+            "p99_unhedged": percentile(self.unhedged_latencies(), 99)
+        }
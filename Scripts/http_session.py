@@ -0,0 +1,32 @@
+import aiohttp
+
+# Defaults used when config.json has no "composo_http" section
+DEFAULT_HTTP_CONFIG = {
+    "pool_size": 32,
+    "pool_size_per_host": 32,
+    "dns_cache_ttl": 300,
+    "keepalive_timeout": 30,
+    "request_timeout": 120,
+    "connect_timeout": 10
+}
+
+def create_session(http_config=None):
+    """Create a pooled aiohttp session that keeps connections alive between requests.
+
+    Must be called from inside a running event loop.
+    """
+    settings = dict(DEFAULT_HTTP_CONFIG)
+    settings.update(http_config or {})
+
+    connector = aiohttp.TCPConnector(
+        limit=settings["pool_size"],
+        limit_per_host=settings["pool_size_per_host"],
+        ttl_dns_cache=settings["dns_cache_ttl"],
+        use_dns_cache=settings["dns_cache_ttl"] > 0,
+        keepalive_timeout=settings["keepalive_timeout"]
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=settings["request_timeout"],
+        connect=settings["connect_timeout"]
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
@@ -0,0 +1,515 @@
+import argparse
+import asyncio
+import hashlib
+import itertools
+import json
+import random
+import re
+import time
+from collections import Counter
+from aiohttp import web
+
+# Local stand-in for the Composo reward endpoint, the Anthropic Messages and OpenAI Chat
+# Completions APIs, and the Anthropic Message Batches and OpenAI Batch/Files APIs, for exercising
+# `evaluate.py` without network access. Point the clients at it with
+# api.url = http://HOST:PORT/api/v1/evals/reward, model.anthropic_base_url = http://HOST:PORT
+# and model.openai_base_url = http://HOST:PORT/v1.
+
+PROVIDERS = ("composo", "anthropic", "openai")
+
+# How the interactive endpoints behave; --profile overrides it per provider. Latency is lognormal
+# around latency_median, except for a tail_rate fraction of requests that take tail_latency.
+# Judges write trailing_lines after their rating, generating one chunk every chunk_interval: streamed
+# replies send each chunk as it is generated, whole replies are sent once all chunks are.
+DEFAULT_BEHAVIOR = {
+    "latency_median": 0.05,
+    "latency_sigma": 0.5,
+    "tail_rate": 0.0,
+    "tail_latency": 2.0,
+    "error_rate": 0.0,
+    "rate_limit_rate": 0.0,
+    "retry_after": 1,
+    "malformed_rate": 0.0,
+    "trailing_lines": 0,
+    "chunk_interval": 0.0
+}
+
+# Ways a judge gets the "Total rating:" line wrong; None drops the line
+MALFORMED_RATINGS = (
+    "{marker} N/A",
+    "{marker} **{score}**",
+    "{marker} {score} out of 100",
+    "{marker}",
+    None
+)
+RATING_LINE = re.compile(r"^(Total rating(?: [AB])?:) (\d+)$")
+
+def request_text(value):
+    """Flatten the text of a request's messages, whatever their content format"""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, list):
+        return "".join(request_text(part) for part in value)
+    if isinstance(value, dict):
+        return request_text(value.get("text") or value.get("content") or "")
+    return ""
+
+def judge_reply(messages, variant=0):
+    """A deterministic judge response with a rating derived from the request text.
+
+    Other variants (e.g. the samples of an n > 1 request) rate the same request differently.
+    """
+    text = request_text(messages)
+    if variant:
+        text += f"\0{variant}"
+    digest = hashlib.sha256(text.encode("utf-8")).digest()
+    if "Answer A:" in text:
+        return (f"Feedback:::\nCriterion analysis A: Stand-in.\nCriterion analysis B: Stand-in.\n"
+                f"Total rating A: {digest[0] % 101}\nTotal rating B: {digest[1] % 101}")
+    return (f"Feedback:::\nCriterion analysis: Stand-in.\nStrengths: None\nWeaknesses: None\n"
+            f"Total rating: {digest[0] % 101}")
+
+def malform_rating(reply, rng):
+    """Replace the rating lines of a judge reply with one of the malformed formats"""
+    template = rng.choice(MALFORMED_RATINGS)
+    lines = []
+    for line in reply.split("\n"):
+        match = RATING_LINE.match(line)
+        if match is None:
+            lines.append(line)
+        elif template is not None:
+            lines.append(template.format(marker=match.group(1), score=match.group(2)))
+    return "\n".join(lines)
+
+def text_chunks(text, size=16):
+    """Split a reply into the text deltas of a streamed response"""
+    return [text[start:start + size] for start in range(0, len(text), size)]
+
+def estimate_usage(messages, reply):
+    return len(request_text(messages)) // 4, len(reply) // 4
+
+class MockProviders:
+    """In-memory state of the fake APIs.
+
+    behavior sets DEFAULT_BEHAVIOR values for every provider and profiles sets them per provider,
+    e.g. {"openai": {"rate_limit_rate": 0.1}}. error_rate also applies to batch requests.
+    """
+
+    def __init__(self, batch_delay=2.0, error_rate=0.0, seed=0, behavior=None, profiles=None):
+        self.batch_delay = batch_delay
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.ids = itertools.count(1)
+        self.anthropic_batches = {}
+        self.openai_batches = {}
+        self.files = {}
+        defaults = {**DEFAULT_BEHAVIOR, "error_rate": error_rate, **(behavior or {})}
+        self.behaviors = {provider: {**defaults, **(profiles or {}).get(provider, {})} for provider in PROVIDERS}
+        self.stats = {provider: Counter() for provider in PROVIDERS}
+
+    def new_id(self, prefix):
+        return f"{prefix}_{next(self.ids):06d}"
+
+    def fails(self):
+        return self.random.random() < self.error_rate
+
+    # Interactive endpoints
+
+    def latency(self, behavior):
+        if self.random.random() < behavior["tail_rate"]:
+            return behavior["tail_latency"]
+        return behavior["latency_median"] * self.random.lognormvariate(0, behavior["latency_sigma"])
+
+    async def simulate(self, provider):
+        """Count a request, wait its latency and return the HTTP status it fails with, or None.
+
+        Rate limited requests are rejected at once, like real rate limits.
+        """
+        behavior = self.behaviors[provider]
+        self.stats[provider]["requests"] += 1
+        if self.random.random() < behavior["rate_limit_rate"]:
+            self.stats[provider]["429"] += 1
+            return 429
+        await asyncio.sleep(self.latency(behavior))
+        if self.random.random() < behavior["error_rate"]:
+            self.stats[provider]["500"] += 1
+            return 500
+        return None
+
+    def error_response(self, provider, status):
+        behavior = self.behaviors[provider]
+        headers = {"retry-after": str(behavior["retry_after"])} if status == 429 else {}
+        message = "Stand-in rate limit" if status == 429 else "Stand-in failure"
+        if provider == "anthropic":
+            error_type = "rate_limit_error" if status == 429 else "api_error"
+            body = {"type": "error", "error": {"type": error_type, "message": message}}
+        elif provider == "openai":
+            body = {"error": {"message": message, "type": "rate_limit_exceeded" if status == 429 else "server_error",
+                              "param": None, "code": None}}
+        else:
+            body = {"detail": message}
+        return web.json_response(body, status=status, headers=headers)
+
+    def judge_text(self, provider, messages, variant=0):
+        reply = judge_reply(messages, variant)
+        reply += "".join(f"\nNote {number}: Stand-in remark." for number in range(1, self.behaviors[provider]["trailing_lines"] + 1))
+        if self.random.random() < self.behaviors[provider]["malformed_rate"]:
+            self.stats[provider]["malformed"] += 1
+            reply = malform_rating(reply, self.random)
+        return reply
+
+    async def generate(self, provider, replies):
+        """Wait the time a whole reply takes to generate before it is sent"""
+        interval = self.behaviors[provider]["chunk_interval"]
+        if interval:
+            await asyncio.sleep(interval * sum(len(text_chunks(reply)) for reply in replies))
+
+    async def stream_events(self, request, provider, events):
+        """Send (event name or None, data) server-sent events, chunk_interval apart.
+
+        Clients may disconnect as soon as they have what they need, which is counted as stopped_early.
+        """
+        interval = self.behaviors[provider]["chunk_interval"]
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+        started = time.monotonic()
+        try:
+            for index, (event, data) in enumerate(events):
+                name = f"event: {event}\n" if event else ""
+                payload = data if isinstance(data, str) else json.dumps(data)
+                await response.write(f"{name}data: {payload}\n\n".encode("utf-8"))
+                # Pace against the start so sleep overhead does not accumulate over the chunks
+                delay = started + (index + 1) * interval - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await response.write_eof()
+        except ConnectionResetError:
+            self.stats[provider]["stopped_early"] += 1
+        return response
+
+    async def composo_reward(self, request):
+        body = await request.json()
+        status = await self.simulate("composo")
+        if status is not None:
+            return self.error_response("composo", status)
+        digest = hashlib.sha256(request_text(body.get("messages", [])).encode("utf-8")).digest()
+        if self.random.random() < self.behaviors["composo"]["malformed_rate"]:
+            self.stats["composo"]["malformed"] += 1
+            return web.json_response(self.random.choice([{"explanation": "Stand-in."}, {"score": "high"},
+                                                         {"score": 1.7, "explanation": "Stand-in."}]))
+        self.stats["composo"]["200"] += 1
+        return web.json_response({"score": digest[2] / 255, "explanation": "Stand-in explanation."})
+
+    async def anthropic_message(self, request):
+        body = await request.json()
+        status = await self.simulate("anthropic")
+        if status is not None:
+            return self.error_response("anthropic", status)
+        # Sampling at an explicit temperature gives a different rating per request, like the real API
+        variant = self.random.randrange(1, 2 ** 31) if body.get("temperature", 0) > 0 else 0
+        reply = self.judge_text("anthropic", [body.get("system", ""), body["messages"]], variant)
+        input_tokens, output_tokens = estimate_usage([body.get("system", ""), body["messages"]], reply)
+        self.stats["anthropic"]["200"] += 1
+        message = {
+            "id": self.new_id("msg"),
+            "type": "message",
+            "role": "assistant",
+            "model": body.get("model", "stand-in"),
+            "content": [{"type": "text", "text": reply}],
+            "stop_reason": "end_turn",
+            "stop_sequence": None,
+            "usage": {"input_tokens": input_tokens, "output_tokens": output_tokens,
+                      "cache_creation_input_tokens": 0, "cache_read_input_tokens": 0}
+        }
+        if not body.get("stream"):
+            await self.generate("anthropic", [reply])
+            return web.json_response(message)
+        start = {**message, "content": [], "stop_reason": None, "usage": {**message["usage"], "output_tokens": 1}}
+        events = [("message_start", {"type": "message_start", "message": start}),
+                  ("content_block_start", {"type": "content_block_start", "index": 0,
+                                           "content_block": {"type": "text", "text": ""}})]
+        events += [("content_block_delta", {"type": "content_block_delta", "index": 0,
+                                            "delta": {"type": "text_delta", "text": chunk}})
+                   for chunk in text_chunks(reply)]
+        events += [("content_block_stop", {"type": "content_block_stop", "index": 0}),
+                   ("message_delta", {"type": "message_delta", "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                                      "usage": {"output_tokens": output_tokens}}),
+                   ("message_stop", {"type": "message_stop"})]
+        return await self.stream_events(request, "anthropic", events)
+
+    async def openai_chat(self, request):
+        body = await request.json()
+        status = await self.simulate("openai")
+        if status is not None:
+            return self.error_response("openai", status)
+        replies = [self.judge_text("openai", body["messages"], variant) for variant in range(body.get("n") or 1)]
+        prompt_tokens, _ = estimate_usage(body["messages"], "")
+        completion_tokens = sum(len(reply) // 4 for reply in replies)
+        self.stats["openai"]["200"] += 1
+        completion_id = self.new_id("chatcmpl")
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                 "total_tokens": prompt_tokens + completion_tokens, "prompt_tokens_details": {"cached_tokens": 0}}
+        if not body.get("stream"):
+            await self.generate("openai", replies)
+            return web.json_response({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "stand-in"),
+                "choices": [{"index": index, "finish_reason": "stop", "message": {"role": "assistant", "content": reply}}
+                            for index, reply in enumerate(replies)],
+                "usage": usage
+            })
+
+        def chunk(choices, chunk_usage=None):
+            return (None, {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                           "model": body.get("model", "stand-in"), "choices": choices, "usage": chunk_usage})
+
+        events = []
+        for index, reply in enumerate(replies):
+            events.append(chunk([{"index": index, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}]))
+            events += [chunk([{"index": index, "delta": {"content": text}, "finish_reason": None}])
+                       for text in text_chunks(reply)]
+            events.append(chunk([{"index": index, "delta": {}, "finish_reason": "stop"}]))
+        if (body.get("stream_options") or {}).get("include_usage"):
+            events.append(chunk([], usage))
+        events.append((None, "[DONE]"))
+        return await self.stream_events(request, "openai", events)
+
+    async def mock_stats(self, request):
+        """Request counts per provider: requests, 200, 429, 500, malformed replies and streams the
+        client stopped reading early"""
+        return web.json_response({provider: dict(counts) for provider, counts in self.stats.items()})
+
+    # Anthropic Message Batches
+
+    def anthropic_batch_object(self, request, batch):
+        ended = time.time() >= batch["ready_at"]
+        count = len(batch["requests"])
+        return {
+            "id": batch["id"],
+            "type": "message_batch",
+            "processing_status": "ended" if ended else "in_progress",
+            "request_counts": {
+                "processing": 0 if ended else count,
+                "succeeded": count - batch["errors"] if ended else 0,
+                "errored": batch["errors"] if ended else 0,
+                "canceled": 0,
+                "expired": 0
+            },
+            "created_at": batch["created_at"],
+            "expires_at": batch["created_at"],
+            "ended_at": batch["created_at"] if ended else None,
+            "archived_at": None,
+            "cancel_initiated_at": None,
+            "results_url": f"{request.scheme}://{request.host}/v1/messages/batches/{batch['id']}/results" if ended else None
+        }
+
+    async def anthropic_create(self, request):
+        body = await request.json()
+        batch_id = self.new_id("msgbatch")
+        results = []
+        for entry in body["requests"]:
+            if self.fails():
+                results.append({"custom_id": entry["custom_id"],
+                                "result": {"type": "errored", "error": {"type": "error", "error": {
+                                    "type": "api_error", "message": "Stand-in failure"}}}})
+                continue
+            params = entry["params"]
+            reply = judge_reply([params.get("system", ""), params["messages"]])
+            input_tokens, output_tokens = estimate_usage(params["messages"], reply)
+            results.append({"custom_id": entry["custom_id"], "result": {"type": "succeeded", "message": {
+                "id": self.new_id("msg"),
+                "type": "message",
+                "role": "assistant",
+                "model": params.get("model", "stand-in"),
+                "content": [{"type": "text", "text": reply}],
+                "stop_reason": "end_turn",
+                "stop_sequence": None,
+                "usage": {"input_tokens": input_tokens, "output_tokens": output_tokens}
+            }}})
+        self.anthropic_batches[batch_id] = {
+            "id": batch_id,
+            "requests": body["requests"],
+            "results": results,
+            "errors": sum(1 for result in results if result["result"]["type"] != "succeeded"),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "ready_at": time.time() + self.batch_delay
+        }
+        return web.json_response(self.anthropic_batch_object(request, self.anthropic_batches[batch_id]))
+
+    async def anthropic_retrieve(self, request):
+        batch = self.anthropic_batches.get(request.match_info["batch_id"])
+        if batch is None:
+            return web.json_response({"type": "error", "error": {"type": "not_found_error"}}, status=404)
+        return web.json_response(self.anthropic_batch_object(request, batch))
+
+    async def anthropic_results(self, request):
+        batch = self.anthropic_batches[request.match_info["batch_id"]]
+        body = "".join(json.dumps(result) + "\n" for result in batch["results"])
+        return web.Response(text=body, content_type="application/binary")
+
+    # OpenAI Files and Batch
+
+    async def openai_upload(self, request):
+        reader = await request.multipart()
+        content, purpose, filename = b"", None, "input.jsonl"
+        async for part in reader:
+            if part.name == "file":
+                filename = part.filename or filename
+                content = await part.read()
+            elif part.name == "purpose":
+                purpose = (await part.read()).decode()
+        file_id = self.new_id("file")
+        self.files[file_id] = content
+        return web.json_response({
+            "id": file_id, "object": "file", "bytes": len(content), "created_at": int(time.time()),
+            "filename": filename, "purpose": purpose or "batch", "status": "processed"
+        })
+
+    async def openai_file_content(self, request):
+        content = self.files.get(request.match_info["file_id"])
+        if content is None:
+            return web.json_response({"error": {"message": "No such file"}}, status=404)
+        return web.Response(body=content, content_type="application/octet-stream")
+
+    def openai_batch_object(self, batch):
+        ended = time.time() >= batch["ready_at"]
+        if ended and batch["output_file_id"] is None:
+            lines = []
+            for raw_line in self.files[batch["input_file_id"]].decode("utf-8").splitlines():
+                entry = json.loads(raw_line)
+                if self.fails():
+                    lines.append({"id": self.new_id("batch_req"), "custom_id": entry["custom_id"],
+                                  "response": {"status_code": 500, "body": {}}, "error": None})
+                    continue
+                reply = judge_reply(entry["body"]["messages"])
+                prompt_tokens, completion_tokens = estimate_usage(entry["body"]["messages"], reply)
+                lines.append({"id": self.new_id("batch_req"), "custom_id": entry["custom_id"], "error": None,
+                              "response": {"status_code": 200, "request_id": self.new_id("req"), "body": {
+                                  "id": self.new_id("chatcmpl"),
+                                  "object": "chat.completion",
+                                  "created": int(time.time()),
+                                  "model": entry["body"].get("model", "stand-in"),
+                                  "choices": [{"index": 0, "finish_reason": "stop",
+                                               "message": {"role": "assistant", "content": reply}}],
+                                  "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                                            "total_tokens": prompt_tokens + completion_tokens}
+                              }}})
+            output_file_id = self.new_id("file")
+            self.files[output_file_id] = "".join(json.dumps(line) + "\n" for line in lines).encode("utf-8")
+            batch["output_file_id"] = output_file_id
+            batch["count"] = len(lines)
+        return {
+            "id": batch["id"],
+            "object": "batch",
+            "endpoint": batch["endpoint"],
+            "input_file_id": batch["input_file_id"],
+            "completion_window": "24h",
+            "status": "completed" if ended else "in_progress",
+            "created_at": batch["created_at"],
+            "output_file_id": batch["output_file_id"],
+            "error_file_id": None,
+            "request_counts": {"total": batch.get("count", 0), "completed": batch.get("count", 0), "failed": 0}
+        }
+
+    async def openai_create_batch(self, request):
+        body = await request.json()
+        batch_id = self.new_id("batch")
+        self.openai_batches[batch_id] = {
+            "id": batch_id,
+            "endpoint": body["endpoint"],
+            "input_file_id": body["input_file_id"],
+            "created_at": int(time.time()),
+            "ready_at": time.time() + self.batch_delay,
+            "output_file_id": None
+        }
+        return web.json_response(self.openai_batch_object(self.openai_batches[batch_id]))
+
+    async def openai_retrieve_batch(self, request):
+        batch = self.openai_batches.get(request.match_info["batch_id"])
+        if batch is None:
+            return web.json_response({"error": {"message": "No such batch"}}, status=404)
+        return web.json_response(self.openai_batch_object(batch))
+
+    def routes(self, app):
+        app.router.add_post("/api/v1/evals/reward", self.composo_reward)
+        app.router.add_post("/v1/messages", self.anthropic_message)
+        app.router.add_post("/v1/chat/completions", self.openai_chat)
+        app.router.add_get("/mock/stats", self.mock_stats)
+        app.router.add_post("/v1/messages/batches", self.anthropic_create)
+        app.router.add_get("/v1/messages/batches/{batch_id}", self.anthropic_retrieve)
+        app.router.add_get("/v1/messages/batches/{batch_id}/results", self.anthropic_results)
+        app.router.add_post("/v1/files", self.openai_upload)
+        app.router.add_get("/v1/files/{file_id}/content", self.openai_file_content)
+        app.router.add_post("/v1/batches", self.openai_create_batch)
+        app.router.add_get("/v1/batches/{batch_id}", self.openai_retrieve_batch)
+
+def create_app(**options):
+    app = web.Application(client_max_size=256 * 1024 * 1024)
+    MockProviders(**options).routes(app)
+    return app
+
+async def serve(host, port, **options):
+    """Start the mock provider server and return (runner, base URL)"""
+    runner = web.AppRunner(create_app(**options))
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{port}"
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Local stand-in for the Composo, Anthropic and OpenAI APIs")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--batch-delay", type=float, default=2.0, help="Seconds before a submitted batch ends")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="Fraction of requests that fail (HTTP 500, or an errored batch entry)")
+    parser.add_argument("--latency-median", type=float, default=DEFAULT_BEHAVIOR["latency_median"],
+                        help="Median seconds before an interactive request is answered")
+    parser.add_argument("--latency-sigma", type=float, default=DEFAULT_BEHAVIOR["latency_sigma"],
+                        help="Spread of the lognormal latency distribution (0 = constant)")
+    parser.add_argument("--tail-rate", type=float, default=DEFAULT_BEHAVIOR["tail_rate"],
+                        help="Fraction of requests that take --tail-latency instead")
+    parser.add_argument("--tail-latency", type=float, default=DEFAULT_BEHAVIOR["tail_latency"])
+    parser.add_argument("--rate-limit-rate", type=float, default=DEFAULT_BEHAVIOR["rate_limit_rate"],
+                        help="Fraction of requests rejected with 429 and a Retry-After header")
+    parser.add_argument("--retry-after", type=float, default=DEFAULT_BEHAVIOR["retry_after"])
+    parser.add_argument("--malformed-rate", type=float, default=DEFAULT_BEHAVIOR["malformed_rate"],
+                        help="Fraction of replies with a malformed \"Total rating:\" line or Composo score")
+    parser.add_argument("--trailing-lines", type=int, default=DEFAULT_BEHAVIOR["trailing_lines"],
+                        help="Lines the stand-in judges write after their rating")
+    parser.add_argument("--chunk-interval", type=float, default=DEFAULT_BEHAVIOR["chunk_interval"],
+                        help="Seconds between the chunks of a streamed reply")
+    parser.add_argument("--profile", help="Per-provider behavior overrides as inline JSON or a JSON file, "
+                                          "e.g. {\"openai\": {\"rate_limit_rate\": 0.1}}")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args(argv)
+
+def server_options(args):
+    """MockProviders options from parsed command line arguments"""
+    profiles = None
+    if args.profile and args.profile.lstrip().startswith("{"):
+        profiles = json.loads(args.profile)
+    elif args.profile:
+        with open(args.profile, "r") as f:
+            profiles = json.load(f)
+    behavior = {name: getattr(args, name) for name in DEFAULT_BEHAVIOR if name != "error_rate"}
+    return {"batch_delay": args.batch_delay, "error_rate": args.error_rate, "seed": args.seed,
+            "behavior": behavior, "profiles": profiles}
+
+async def main():
+    args = parse_args()
+    runner, url = await serve(args.host, args.port, **server_options(args))
+    print(f"Mock providers listening on {url}")
+    print(f"  api.url = {url}/api/v1/evals/reward")
+    print(f"  model.anthropic_base_url = {url}")
+    print(f"  model.openai_base_url = {url}/v1")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,115 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+class ResponseCache:
+    """Persistent SQLite cache of judge responses, keyed by a hash of everything that determines the response.
+
+    Entries are evicted least-recently-used first once the stored responses exceed max_bytes.
+    """
+
+    def __init__(self, path, max_bytes=512 * 1024 * 1024, per_sample=False, sample_index=0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.per_sample = per_sample
+        self.sample_index = sample_index
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # Shard processes can share one cache file; wait for their writes instead of failing
+        self.connection = sqlite3.connect(path, timeout=30)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self.connection.commit()
+        self.total_bytes = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def key(self, evaluator, model, temperature, system_prompt, prompt, response, criterion, samples=1):
+        """Return the cache key for one judge call.
+
+        A temperature of None means the provider default. When per_sample is enabled, calls that
+        are not at temperature 0 also key on the sample index, so each sample of a sampling study
+        is cached separately. Self-consistency calls (samples > 1) key on the number of samples.
+        """
+        parts = {
+            "evaluator": evaluator,
+            "model": model,
+            "temperature": temperature,
+            "system_prompt": system_prompt,
+            "prompt": prompt,
+            "response": response,
+            "criterion": criterion
+        }
+        if self.per_sample and temperature != 0:
+            parts["sample_index"] = self.sample_index
+        if samples > 1:
+            parts["samples"] = samples
+        encoded = json.dumps(parts, sort_keys=True, ensure_ascii=False).encode("utf-8")
+        return hashlib.sha256(encoded).hexdigest()
+
+    def get(self, key):
+        """Return the cached (score, text) for a key, or None"""
+        row = self.connection.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.connection.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+        self.connection.commit()
+        score, text = json.loads(row[0])
+        return (score, text)
+
+    def __contains__(self, key):
+        """Whether a key is cached, without counting a hit or miss or refreshing its last use"""
+        return self.connection.execute("SELECT 1 FROM responses WHERE key = ?", (key,)).fetchone() is not None
+
+    def put(self, key, score, text):
+        """Store a successful judge response"""
+        value = json.dumps([score, text], ensure_ascii=False)
+        size = len(value.encode("utf-8"))
+        previous = self.connection.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+        if previous is not None:
+            self.total_bytes -= previous[0]
+        self.connection.execute(
+            "INSERT OR REPLACE INTO responses (key, value, size, last_used) VALUES (?, ?, ?, ?)",
+            (key, value, size, time.time())
+        )
+        self.total_bytes += size
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+        self.connection.commit()
+
+    def evict(self):
+        """Delete least recently used entries until the cache is back under 90% of max_bytes"""
+        target = self.max_bytes * 0.9
+        rows = self.connection.execute("SELECT key, size FROM responses ORDER BY last_used").fetchall()
+        for key, size in rows:
+            if self.total_bytes <= target:
+                break
+            self.connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self.total_bytes -= size
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0,
+            "evictions": self.evictions,
+            "stored_bytes": self.total_bytes
+        }
+
+    def close(self):
+        self.connection.close()
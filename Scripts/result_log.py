@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+import time
+import uuid
+
+# Fields that identify a dataset item; two items with the same values are the same piece of work
+ITEM_KEY_FIELDS = ("prompt", "criterion", "chosen", "rejected", "datasource")
+
+def item_key(item):
+    """Return a stable hash identifying a dataset item across runs"""
+    identity = {field: item.get(field, "") for field in ITEM_KEY_FIELDS}
+    encoded = json.dumps(identity, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()[:32]
+
+def run_header():
+    """The first line of a new result log: a unique run id, so readers following the log can tell
+    a new run that rewrote it from the same run growing"""
+    return {"run": uuid.uuid4().hex, "started": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}
+
+def is_run_header(record):
+    return "run" in record and "result" not in record
+
+def read_log(path):
+    """Read a result log, returning (records by item key, byte offset of the last complete line).
+
+    A line cut short by a crash is ignored. When the same key appears more than once
+    the last record wins.
+    """
+    records, valid_end = read_new_records(path)
+    return {record["key"]: record for record in records}, valid_end
+
+def read_new_records(path, offset=0):
+    """Read the records appended to a result log after a byte offset.
+
+    Returns (records in file order, offset just past the last complete line). A line that is
+    still being written, or was cut short by a crash, is left for the next call. The run header
+    is skipped.
+    """
+    records = []
+    if not os.path.exists(path):
+        return records, offset
+
+    with open(path, "rb") as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            if not is_run_header(record):
+                records.append(record)
+            offset += len(line)
+    return records, offset
+
+class ResultLog:
+    """Append-only JSONL log of item results, fsynced in batches"""
+
+    def __init__(self, path, resume=False, fsync_every=16, fsync_interval=5.0):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.completed = {}
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        if resume:
+            self.completed, valid_end = read_log(path)
+            self.file = open(path, "ab")
+            # Drop a partially written trailing line so new records start on a clean line
+            self.file.truncate(valid_end)
+        else:
+            self.file = open(path, "wb")
+        if self.file.tell() == 0:
+            self.file.write(json.dumps(run_header()).encode("utf-8") + b"\n")
+            self.file.flush()
+
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def append(self, key, index, result):
+        """Append one item result to the log"""
+        record = {"key": key, "index": index, "result": result}
+        self.file.write(json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n")
+        self.file.flush()
+        self.completed[key] = record
+        self.unsynced += 1
+        if self.unsynced >= self.fsync_every or time.monotonic() - self.last_sync >= self.fsync_interval:
+            self.sync()
+
+    def sync(self):
+        """Force buffered records to disk"""
+        if self.unsynced:
+            os.fsync(self.file.fileno())
+            self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def close(self):
+        if not self.file.closed:
+            self.sync()
+            self.file.close()
+
+def compact(log_path, output_path):
+    """Write the merged JSON results file from a result log, in dataset order.
+
+    The output is written to a temporary file and renamed into place, so readers never
+    see a partially written file. Returns the number of results written.
+    """
+    records, _ = read_log(log_path)
+    ordered = sorted(records.values(), key=lambda record: record["index"])
+    return write_results(ordered, output_path)
+
+def write_results(records, output_path):
+    """Atomically write the results of log records, in the given order, as a JSON list"""
+    results = [record["result"] for record in records]
+    temp_path = output_path + ".tmp"
+    with open(temp_path, "w") as f:
+        json.dump(results, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, output_path)
+    return len(results)
@@ -0,0 +1,331 @@
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import numpy as np
+from dataset_reader import detect_format, iter_items, iter_jsonl
+from result_log import is_run_header, item_key, read_log
+
+STORE_VERSION = 1
+# String fields stored as category codes with a row index for lookups; other strings go to the blob store
+INDEXED_FIELDS = ("datasource", "criterion")
+
+class BlobWriter:
+    """Appends texts to blobs.bin once per unique content, keyed by hash"""
+
+    def __init__(self, directory):
+        self.file = open(os.path.join(directory, "blobs.bin"), "wb")
+        self.ids = {}
+        self.hashes = []
+        self.offsets = [0]
+
+    def add(self, text):
+        """Return the blob id of a text, writing it only the first time it is seen"""
+        data = text.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()[:32]
+        blob_id = self.ids.get(digest)
+        if blob_id is None:
+            blob_id = self.ids[digest] = len(self.hashes)
+            self.hashes.append(digest)
+            self.file.write(data)
+            self.offsets.append(self.offsets[-1] + len(data))
+        return blob_id
+
+    def close(self, directory):
+        self.file.close()
+        np.save(os.path.join(directory, "blobs.offsets.npy"), np.array(self.offsets, dtype=np.int64))
+        np.save(os.path.join(directory, "blobs.hashes.npy"), np.array(self.hashes, dtype="S32"))
+
+class FieldBuilder:
+    """Collects one field's values, turning texts into blob ids or category codes as they arrive"""
+
+    def __init__(self, name, rows_before):
+        self.name = name
+        self.values = [None] * rows_before
+        self.present = [False] * rows_before
+        self.kinds = set()
+        self.categories = {}
+
+    def add(self, value, blobs):
+        self.present.append(True)
+        if value is None:
+            self.values.append(None)
+            return
+        if isinstance(value, bool):
+            self.kinds.add("bool")
+        elif isinstance(value, (int, float)):
+            self.kinds.add("integer" if isinstance(value, int) else "number")
+        elif isinstance(value, str) and self.name in INDEXED_FIELDS:
+            self.kinds.add("category")
+            value = self.categories.setdefault(value, len(self.categories))
+        elif isinstance(value, str):
+            self.kinds.add("text")
+            value = blobs.add(value)
+        else:
+            self.kinds.add("json")
+            value = blobs.add(json.dumps(value, ensure_ascii=False))
+        self.values.append(value)
+
+    def skip(self):
+        self.values.append(None)
+        self.present.append(False)
+
+    def kind(self):
+        kinds = set(self.kinds)
+        if {"integer", "number"} <= kinds:
+            kinds.discard("integer")
+        if len(kinds) > 1:
+            raise ValueError(f"Field {self.name!r} mixes value types ({', '.join(sorted(kinds))}) and cannot be stored")
+        return kinds.pop() if kinds else "number"
+
+    def save(self, directory):
+        """Write the column (and its presence mask, if the field is missing from some rows); return its metadata"""
+        kind = self.kind()
+        if kind == "bool":
+            column = np.array([-1 if value is None else int(value) for value in self.values], dtype=np.int8)
+        elif kind in ("integer", "number"):
+            column = np.array(self.values, dtype=np.float64).reshape(len(self.values))
+        else:
+            column = np.array([-1 if value is None else value for value in self.values], dtype=np.int64)
+        np.save(os.path.join(directory, f"col.{self.name}.npy"), column)
+        meta = {"name": self.name, "kind": kind, "optional": not all(self.present)}
+        if meta["optional"]:
+            np.save(os.path.join(directory, f"col.{self.name}.present.npy"), np.array(self.present, dtype=bool))
+        if kind == "number" and "integer" in self.kinds:
+            # Integers among floats (a score of exactly 0 or 1) are exported as integers again
+            meta["mixed_integers"] = True
+            np.save(os.path.join(directory, f"col.{self.name}.integer.npy"),
+                    np.array([isinstance(value, int) for value in self.values], dtype=bool))
+        if kind == "category":
+            meta["categories"] = list(self.categories)
+            # Rows of each category, grouped: rows[offsets[c]:offsets[c + 1]] are the rows of category c
+            order = np.argsort(column, kind="stable")
+            offsets = np.searchsorted(column[order], np.arange(len(self.categories) + 1))
+            np.save(os.path.join(directory, f"col.{self.name}.rows.npy"), order.astype(np.int64))
+            np.save(os.path.join(directory, f"col.{self.name}.offsets.npy"), offsets.astype(np.int64))
+        return meta
+
+def write_store(records, directory):
+    """Write result log records ({"key", "index", "result"}), in the given order, as a result store.
+
+    The store is built next to the target directory and swapped into place, so readers never see
+    a partially written store. Returns the number of results written.
+    """
+    temp_directory = directory.rstrip("/\\") + ".tmp"
+    shutil.rmtree(temp_directory, ignore_errors=True)
+    os.makedirs(temp_directory)
+    blobs = BlobWriter(temp_directory)
+    fields = {}
+    keys = []
+    positions = []
+    for record in records:
+        result = record["result"]
+        for name in result:
+            if name not in fields:
+                fields[name] = FieldBuilder(name, len(keys))
+        for name, builder in fields.items():
+            if name in result:
+                builder.add(result[name], blobs)
+            else:
+                builder.skip()
+        keys.append(record["key"])
+        positions.append(record["index"])
+    blobs.close(temp_directory)
+
+    keys = np.array(keys, dtype="S32")
+    order = np.argsort(keys, kind="stable")
+    np.save(os.path.join(temp_directory, "key.npy"), keys)
+    np.save(os.path.join(temp_directory, "key.sorted.npy"), keys[order])
+    np.save(os.path.join(temp_directory, "key.order.npy"), order.astype(np.int64))
+    np.save(os.path.join(temp_directory, "index.npy"), np.array(positions, dtype=np.int64))
+    meta = {
+        "version": STORE_VERSION,
+        "rows": len(keys),
+        "fields": [builder.save(temp_directory) for builder in fields.values()]
+    }
+    with open(os.path.join(temp_directory, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+
+    if os.path.exists(directory):
+        old_directory = directory.rstrip("/\\") + ".old"
+        shutil.rmtree(old_directory, ignore_errors=True)
+        os.replace(directory, old_directory)
+        os.replace(temp_directory, directory)
+        shutil.rmtree(old_directory)
+    else:
+        os.replace(temp_directory, directory)
+    return len(keys)
+
+def read_records(path):
+    """Log records, in dataset order, from a result log or a file of results (JSON array or JSONL)"""
+    if detect_format(path) == "jsonl":
+        first = next((record for record in iter_jsonl(path) if not is_run_header(record)), {})
+        if "key" in first and "result" in first:
+            records, _ = read_log(path)
+            return sorted(records.values(), key=lambda record: record["index"])
+    return ({"key": item_key(result), "index": index, "result": result}
+            for index, result in enumerate(iter_items(path)))
+
+def store_from_file(path, directory):
+    """Build a result store from a result log or merged results file"""
+    return write_store(read_records(path), directory)
+
+class ResultStore:
+    """Read access to a result store; columns and texts are memory-mapped and only read when used"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, "meta.json"), "r") as f:
+            meta = json.load(f)
+        if meta["version"] != STORE_VERSION:
+            raise ValueError(f"{directory}: unsupported result store version {meta['version']}")
+        self.rows = meta["rows"]
+        self.fields = {field["name"]: field for field in meta["fields"]}
+        self.arrays = {}
+        self.blobs = None
+        self.blob_file = None
+
+    def array(self, name):
+        if name not in self.arrays:
+            self.arrays[name] = np.load(os.path.join(self.directory, f"{name}.npy"), mmap_mode="r")
+        return self.arrays[name]
+
+    def column(self, name):
+        """The stored column of a field: float64 numbers (NaN = null), int8 booleans (-1 = null),
+        or int64 category codes / blob ids (-1 = null)"""
+        if name not in self.fields:
+            raise KeyError(f"No field {name!r} in result store {self.directory}")
+        return self.array(f"col.{name}")
+
+    def categories(self, name):
+        return self.fields[name]["categories"]
+
+    def rows_where(self, **values):
+        """Sorted row numbers matching every given indexed field value, e.g. datasource="XSUM" """
+        rows = None
+        for name, value in values.items():
+            field = self.fields.get(name)
+            if field is None or field["kind"] != "category":
+                raise KeyError(f"Field {name!r} is not indexed in result store {self.directory}")
+            if value not in field["categories"]:
+                return np.array([], dtype=np.int64)
+            code = field["categories"].index(value)
+            offsets = self.array(f"col.{name}.offsets")
+            matches = np.sort(self.array(f"col.{name}.rows")[offsets[code]:offsets[code + 1]])
+            rows = matches if rows is None else np.intersect1d(rows, matches, assume_unique=True)
+        return np.arange(self.rows) if rows is None else rows
+
+    def find(self, key):
+        """Row number of an item key, or None"""
+        sorted_keys = self.array("key.sorted")
+        encoded = key.encode("ascii")
+        position = int(np.searchsorted(sorted_keys, encoded))
+        if position < len(sorted_keys) and sorted_keys[position] == encoded:
+            return int(self.array("key.order")[position])
+        return None
+
+    def text(self, blob_id):
+        """The text of a blob id"""
+        if self.blobs is None:
+            self.blob_file = open(os.path.join(self.directory, "blobs.bin"), "rb")
+            size = os.fstat(self.blob_file.fileno()).st_size
+            self.blobs = mmap.mmap(self.blob_file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        offsets = self.array("blobs.offsets")
+        return self.blobs[offsets[blob_id]:offsets[blob_id + 1]].decode("utf-8")
+
+    def value(self, name, row):
+        """A field's value in one row as it was in the results, or None"""
+        field = self.fields[name]
+        stored = self.column(name)[row]
+        kind = field["kind"]
+        if kind in ("integer", "number"):
+            if np.isnan(stored):
+                return None
+            if kind == "integer" or (field.get("mixed_integers") and self.array(f"col.{name}.integer")[row]):
+                return int(stored)
+            return float(stored)
+        if stored < 0:
+            return None
+        if kind == "bool":
+            return bool(stored)
+        if kind == "category":
+            return field["categories"][stored]
+        text = self.text(int(stored))
+        return json.loads(text) if kind == "json" else text
+
+    def record(self, row):
+        """The result dict of a row, with the fields of the original result"""
+        result = {}
+        for name, field in self.fields.items():
+            if field["optional"] and not self.array(f"col.{name}.present")[row]:
+                continue
+            result[name] = self.value(name, row)
+        return result
+
+    def records(self, rows=None):
+        """Yield the result dicts of the given rows, or of all rows in dataset order"""
+        for row in (range(self.rows) if rows is None else rows):
+            yield self.record(int(row))
+
+    def key(self, row):
+        return self.array("key")[row].decode("ascii")
+
+    def export_json(self, output_path, rows=None):
+        """Atomically write rows (default: all) in the merged results JSON format; returns the count"""
+        temp_path = output_path + ".tmp"
+        count = 0
+        with open(temp_path, "w") as f:
+            f.write("[")
+            for result in self.records(rows):
+                f.write(",\n  " if count else "\n  ")
+                f.write(json.dumps(result, indent=2).replace("\n", "\n  "))
+                count += 1
+            f.write("\n]" if count else "]")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, output_path)
+        return count
+
+    def close(self):
+        if self.blob_file is not None:
+            if self.blobs:
+                self.blobs.close()
+            self.blob_file.close()
+            self.blob_file = self.blobs = None
+        self.arrays = {}
+
+def main():
+    parser = argparse.ArgumentParser(description="Build, query and export an indexed result store")
+    parser.add_argument("--store", default="results/store", help="Result store directory")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="Build the store from a result log or merged results file")
+    build.add_argument("--input", default="results/evaluation_log.jsonl")
+    export = commands.add_parser("export", help="Write results in the merged JSON format")
+    export.add_argument("--output", default="results/merged_evaluation.json")
+    export.add_argument("--datasource")
+    export.add_argument("--criterion")
+    get = commands.add_parser("get", help="Print the result of one item key")
+    get.add_argument("key")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        count = store_from_file(args.input, args.store)
+        print(f"Stored {count} results from {args.input} in {args.store}")
+        return
+    store = ResultStore(args.store)
+    if args.command == "export":
+        filters = {name: value for name, value in (("datasource", args.datasource), ("criterion", args.criterion))
+                   if value is not None}
+        count = store.export_json(args.output, store.rows_where(**filters) if filters else None)
+        print(f"Exported {count} results from {args.store} to {args.output}")
+    else:
+        row = store.find(args.key)
+        if row is None:
+            raise SystemExit(f"No result for item {args.key} in {args.store}")
+        print(json.dumps(store.record(row), indent=2))
+    store.close()
+
+if __name__ == "__main__":
+    main()
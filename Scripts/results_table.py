@@ -0,0 +1,413 @@
+import json
+import os
+import warnings
+import numpy as np
+from dataset_reader import iter_items
+from result_log import is_run_header
+from result_store import ResultStore
+
+# Display names of the built-in judges, for results written before results listed their judges
+JUDGE_NAMES = {
+    "composo": "Composo",
+    "claude": "Claude",
+    "openai": "OpenAI",
+    "claude_pairwise": "Claude (pairwise)",
+    "openai_pairwise": "OpenAI (pairwise)"
+}
+
+# Outcome codes of a judge on one item; ABSENT where the judge did not run on the item
+WIN, LOSS, TIE, FAILED, ABSENT = 0, 1, 2, 3, 4
+OUTCOMES = 5
+
+# String fields kept as categorical columns for grouping; long texts are not loaded
+DEFAULT_KEYS = ("criterion", "datasource")
+
+def judge_fields(judge):
+    """Win, chosen score and rejected score fields of a judge"""
+    return f"{judge}_win", f"chosen_{judge}", f"rejected_{judge}"
+
+def sample_fields(judge):
+    """Self-consistency fields of a judge: the sample lists of both answers and the majority vote"""
+    return f"chosen_{judge}_samples", f"rejected_{judge}_samples", f"{judge}_majority"
+
+def record_judges(record):
+    """Judge -> display name of the judges that ran on a result. Older results without a judges
+    field are read by their win fields."""
+    judges = record.get("judges")
+    if judges is None:
+        judges = {field[:-4]: JUDGE_NAMES.get(field[:-4], field[:-4]) for field in record if field.endswith("_win")}
+    return judges
+
+def outcomes(wins, chosen, rejected, ran=None):
+    """Outcome codes of one judge from its win and score columns (NaN where missing).
+
+    Scores decide when both are present, so equal scores are ties; otherwise the win field does.
+    Rows where ran is False are ABSENT.
+    """
+    scored = ~np.isnan(chosen) & ~np.isnan(rejected)
+    codes = np.where(np.isnan(wins), FAILED, np.where(wins > 0, WIN, LOSS))
+    by_score = np.where(chosen > rejected, WIN, np.where(chosen == rejected, TIE, LOSS))
+    codes = np.where(scored, by_score, codes)
+    if ran is not None:
+        codes = np.where(ran, codes, ABSENT)
+    return codes.astype(np.int8)
+
+def judge_outcomes_of(wins, chosen, rejected, majority, ran=None):
+    """Outcome codes of one judge; rows with a majority vote (the chosen answer's percentage of
+    won paired samples, NaN where missing) are decided by the vote instead of the ratings"""
+    voted = ~np.isnan(majority)
+    return outcomes(wins, np.where(voted, majority, chosen), np.where(voted, 100 - majority, rejected), ran)
+
+def bootstrap_proportions(successes, trials, samples=1000, confidence=0.95, rng=None):
+    """Percentile bootstrap intervals for many proportions at once.
+
+    Resampling n items with replacement from a group with k successes gives Binomial(n, k/n)
+    successes, so all groups and resamples are drawn in one vectorized binomial call instead of
+    materializing resampled rows. Returns (low, high) arrays; NaN where trials is 0.
+    """
+    rng = rng if rng is not None else np.random.default_rng(0)
+    successes = np.asarray(successes, dtype=np.int64)
+    trials = np.asarray(trials, dtype=np.int64)
+    safe_trials = np.maximum(trials, 1)
+    draws = rng.binomial(safe_trials, successes / safe_trials, size=(samples, len(trials))) / safe_trials
+    alpha = (1 - confidence) / 2
+    low, high = np.quantile(draws, [alpha, 1 - alpha], axis=0)
+    empty = trials == 0
+    low[empty] = np.nan
+    high[empty] = np.nan
+    return low, high
+
+def aggregate_samples(chosen, rejected, method):
+    """Aggregate NaN-padded sample scores of shape (rows, k) into the (chosen, rejected) scores that
+    decide each row's verdict, as evaluate.py does: the mean or median of each answer's samples, or
+    for majority the percentage of paired samples each answer won (ties count half). NaN where a
+    row has no samples.
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        if method == "mean":
+            return np.nanmean(chosen, axis=1), np.nanmean(rejected, axis=1)
+        if method == "median":
+            return np.nanmedian(chosen, axis=1), np.nanmedian(rejected, axis=1)
+        paired = ~np.isnan(chosen) & ~np.isnan(rejected)
+        won = np.where(chosen > rejected, 1.0, np.where(chosen == rejected, 0.5, 0.0)) * paired
+        share = won.sum(axis=1) / paired.sum(axis=1) * 100
+        return share, 100 - share
+
+def sample_matrix(lists):
+    """Lists of sample scores (None for rows without samples) as a NaN-padded (rows, k) array"""
+    width = max((len(values) for values in lists if values), default=0)
+    matrix = np.full((len(lists), width), np.nan)
+    for row, values in enumerate(lists):
+        if values:
+            matrix[row, :len(values)] = values
+    return matrix
+
+class ResultsTable:
+    """Evaluation results as NumPy columns: categorical keys, judge outcomes and scores"""
+
+    def __init__(self, keys, outcomes, scores, rows, samples=None, names=None):
+        self.keys = keys          # name -> (int codes, array of category labels)
+        self.outcomes = outcomes  # judge -> int8 outcome codes
+        self.scores = scores      # field -> float64 scores, NaN where missing
+        self.rows = rows
+        # judge -> (chosen samples, rejected samples, aggregate method), for self-consistency judges
+        self.samples = samples or {}
+        # judge -> display name, in the order the judges appear in the results
+        self.names = names if names is not None else {judge: JUDGE_NAMES.get(judge, judge) for judge in outcomes}
+
+    @classmethod
+    def from_records(cls, records, keys=DEFAULT_KEYS):
+        """Build a table from result dicts, or result log records wrapping them.
+
+        Judges are collected from the results as they appear; rows before a judge's first result
+        get ABSENT outcomes for it.
+        """
+        values = {key: [] for key in keys}
+        names = {}
+        ran = {}
+        aggregates = {}
+        rows = 0
+        for record in records:
+            if is_run_header(record):
+                continue
+            record = record.get("result", record)
+            for key in keys:
+                values[key].append(record.get(key))
+            judges = record_judges(record)
+            for judge, name in judges.items():
+                if judge not in names:
+                    names[judge] = name
+                    ran[judge] = [False] * rows
+                    for field in judge_fields(judge) + sample_fields(judge):
+                        values[field] = [None] * rows
+            for judge in names:
+                ran[judge].append(judge in judges)
+                for field in judge_fields(judge) + sample_fields(judge):
+                    values[field].append(record.get(field))
+                if f"{judge}_aggregate" in record:
+                    aggregates.setdefault(judge, record[f"{judge}_aggregate"])
+            rows += 1
+
+        columns = {}
+        for key in keys:
+            labels = np.array(["unknown" if value is None else str(value) for value in values[key]], dtype=str)
+            categories, codes = np.unique(labels, return_inverse=True)
+            columns[key] = (codes.astype(np.int64), categories)
+        # None becomes NaN, and True/False 1.0/0.0
+        numeric = {field: np.array(values[field], dtype=np.float64).reshape(rows)
+                   for judge in names for field in judge_fields(judge) + (f"{judge}_majority",)}
+        judge_outcomes = {judge: judge_outcomes_of(*(numeric[field] for field in judge_fields(judge)),
+                                                   numeric[f"{judge}_majority"], np.array(ran[judge], dtype=bool))
+                          for judge in names}
+        scores = {field: numeric[field] for judge in names for field in judge_fields(judge)[1:]}
+        samples = {judge: (sample_matrix(values[f"chosen_{judge}_samples"]),
+                           sample_matrix(values[f"rejected_{judge}_samples"]), method)
+                   for judge, method in aggregates.items()}
+        return cls(columns, judge_outcomes, scores, rows, samples, names)
+
+    @classmethod
+    def from_store(cls, store, keys=DEFAULT_KEYS):
+        """Build a table from a result store's columns without reading any texts but the distinct
+        judge lists"""
+        def numeric(field):
+            if field not in store.fields:
+                return np.full(store.rows, np.nan)
+            column = np.asarray(store.column(field))
+            if store.fields[field]["kind"] == "bool":
+                return np.where(column < 0, np.nan, column).astype(np.float64)
+            return column.astype(np.float64)
+
+        columns = {}
+        for key in keys:
+            field = store.fields.get(key)
+            if field is not None and field["kind"] == "category":
+                stored = np.asarray(store.column(key))
+                labels = np.array(field["categories"] + ["unknown"], dtype=str)[stored]
+            else:
+                labels = np.array(["unknown" if value is None else str(value) for value in
+                                   (store.value(key, row) if field is not None else None for row in range(store.rows))],
+                                  dtype=str)
+            categories, codes = np.unique(labels, return_inverse=True)
+            columns[key] = (codes.astype(np.int64), categories)
+
+        def present(field):
+            if field not in store.fields:
+                return np.zeros(store.rows, dtype=bool)
+            if not store.fields[field]["optional"]:
+                return np.ones(store.rows, dtype=bool)
+            return np.asarray(store.array(f"col.{field}.present"), dtype=bool)
+
+        # Judge lists are JSON texts stored once per distinct list, so only those few are read;
+        # rows without one (older results) are read by their win fields
+        listed = np.asarray(store.column("judges")) if "judges" in store.fields else np.full(store.rows, -1)
+        blob_ids, inverse = np.unique(listed, return_inverse=True)
+        lists = [json.loads(store.text(int(blob_id))) if blob_id >= 0 else None for blob_id in blob_ids]
+        names = {}
+        for judges in lists:
+            if judges is None:
+                judges = {field[:-4]: JUDGE_NAMES.get(field[:-4], field[:-4]) for field in store.fields
+                          if field.endswith("_win")}
+            for judge, name in judges.items():
+                names.setdefault(judge, name)
+        judge_outcomes = {}
+        for judge in names:
+            in_list = np.array([judges is not None and judge in judges for judges in lists], dtype=bool)[inverse]
+            ran = np.where(listed >= 0, in_list, present(f"{judge}_win"))
+            judge_outcomes[judge] = judge_outcomes_of(*(numeric(field) for field in judge_fields(judge)),
+                                                      numeric(f"{judge}_majority"), ran)
+        scores = {field: numeric(field) for judge in names for field in judge_fields(judge)[1:]}
+        # Sample lists are stored as JSON texts, read only for self-consistency judges
+        samples = {}
+        for judge in names:
+            if f"{judge}_aggregate" not in store.fields:
+                continue
+            methods = (store.value(f"{judge}_aggregate", row) for row in range(store.rows))
+            method = next(method for method in methods if method is not None)
+            samples[judge] = tuple(
+                sample_matrix([store.value(field, row) for row in range(store.rows)] if field in store.fields
+                              else [None] * store.rows)
+                for field in (f"chosen_{judge}_samples", f"rejected_{judge}_samples")
+            ) + (method,)
+        return cls(columns, judge_outcomes, scores, store.rows, samples, names)
+
+    @classmethod
+    def load(cls, path, keys=DEFAULT_KEYS):
+        """Load a result store directory, or stream a merged results file (JSON array) or result log (JSONL)"""
+        if os.path.isdir(path):
+            store = ResultStore(path)
+            try:
+                return cls.from_store(store, keys)
+            finally:
+                store.close()
+        return cls.from_records(iter_items(path), keys)
+
+    def active_judges(self):
+        """Judges that ran on at least one item, also if every call failed, as (judge, display name)"""
+        return [(judge, name) for judge, name in self.names.items() if np.any(self.outcomes[judge] != ABSENT)]
+
+    def groups(self, by=()):
+        """Return (group id per row, list of group label tuples) for a combination of keys"""
+        if not by:
+            return np.zeros(self.rows, dtype=np.int64), [()]
+        codes = [self.keys[key][0] for key in by]
+        sizes = [len(self.keys[key][1]) for key in by]
+        combined = np.ravel_multi_index(codes, sizes)
+        unique, group_ids = np.unique(combined, return_inverse=True)
+        labels = [tuple(self.keys[key][1][code] for key, code in zip(by, np.unravel_index(value, sizes)))
+                  for value in unique]
+        return group_ids, labels
+
+    def outcome_counts(self, judge, group_ids, group_count):
+        """Array of shape (groups, 5): wins, losses, ties, failures and items not judged per group"""
+        counts = np.bincount(group_ids * OUTCOMES + self.outcomes[judge], minlength=group_count * OUTCOMES)
+        return counts.reshape(group_count, OUTCOMES)
+
+    def win_rates(self, judges, by=(), samples=1000, confidence=0.95, seed=0):
+        """Win rate per judge and group with bootstrap intervals.
+
+        The win rate is wins over decided comparisons (wins, losses and ties); failures, where a
+        judge produced no score, and items the judge did not run on are counted separately.
+        """
+        rng = np.random.default_rng(seed)
+        group_ids, labels = self.groups(by)
+        table = {}
+        for judge in judges:
+            counts = self.outcome_counts(judge, group_ids, len(labels))
+            decided = counts[:, WIN] + counts[:, LOSS] + counts[:, TIE]
+            rate = np.divide(counts[:, WIN], decided, out=np.full(len(labels), np.nan), where=decided > 0)
+            low, high = bootstrap_proportions(counts[:, WIN], decided, samples, confidence, rng)
+            table[judge] = {"counts": counts, "decided": decided, "rate": rate, "low": low, "high": high}
+        return labels, table
+
+    def agreement(self, judges, samples=1000, confidence=0.95, seed=0):
+        """How often each pair of judges, and all judges together, agree on whether the chosen
+        response won, over the items all of them decided.
+
+        Returns a list of (judges, agreeing items, compared items, low, high).
+        """
+        rng = np.random.default_rng(seed)
+        decided = {judge: self.outcomes[judge] < FAILED for judge in judges}
+        pairs = [(judges[i], judges[j]) for i in range(len(judges)) for j in range(i + 1, len(judges))]
+        combos = [list(pair) for pair in pairs]
+        if len(judges) > 2:
+            combos.append(list(judges))
+        agree, compared = [], []
+        for combo in combos:
+            mask = np.logical_and.reduce([decided[judge] for judge in combo])
+            first = self.outcomes[combo[0]] == WIN
+            same = np.logical_and.reduce([(self.outcomes[judge] == WIN) == first for judge in combo[1:]])
+            agree.append(int(np.count_nonzero(same & mask)))
+            compared.append(int(np.count_nonzero(mask)))
+        low, high = bootstrap_proportions(agree, compared, samples, confidence, rng)
+        return [(combo, agree[i], compared[i], low[i], high[i]) for i, combo in enumerate(combos)]
+
+    def sample_stability(self, judge):
+        """How stable a self-consistency judge's verdicts are in the number of samples.
+
+        For k = 1 up to the number of samples, re-aggregates the first k samples of each answer and
+        compares the outcome with the one from all samples. Items tied at k (e.g. a split majority
+        vote at even k) are counted separately rather than as disagreeing. Returns a list of (k,
+        agreeing items, compared items, tied items, mean sample standard deviation of an answer at k).
+        """
+        chosen, rejected, method = self.samples[judge]
+        no_wins = np.full(self.rows, np.nan)
+        full = outcomes(no_wins, *aggregate_samples(chosen, rejected, method))
+        stability = []
+        for k in range(1, chosen.shape[1] + 1):
+            partial = outcomes(no_wins, *aggregate_samples(chosen[:, :k], rejected[:, :k], method))
+            scored = (partial != FAILED) & (full != FAILED)
+            tied = scored & (partial == TIE)
+            compared = scored & ~tied
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", RuntimeWarning)
+                spread = np.nanmean(np.nanstd(np.concatenate([chosen[:, :k], rejected[:, :k]]), axis=1))
+            stability.append((k, int(np.count_nonzero(compared & (partial == full))), int(np.count_nonzero(compared)),
+                              int(np.count_nonzero(tied)), float(spread)))
+        return stability
+
+    def score_summary(self, field):
+        """Count, mean, standard deviation and quantiles of a score column, ignoring missing scores"""
+        values = self.scores[field]
+        values = values[~np.isnan(values)]
+        if values.size == 0:
+            return None
+        quantiles = np.quantile(values, [0, 0.25, 0.5, 0.75, 1])
+        return {
+            "count": int(values.size),
+            "mean": float(values.mean()),
+            "std": float(values.std()),
+            "min": float(quantiles[0]),
+            "p25": float(quantiles[1]),
+            "median": float(quantiles[2]),
+            "p75": float(quantiles[3]),
+            "max": float(quantiles[4])
+        }
+
+class RunningTotals:
+    """Win outcome counts per judge and group, and score moments, updated one batch of new
+    results at a time so a growing result log never has to be read again"""
+
+    def __init__(self, by=tuple((key,) for key in DEFAULT_KEYS)):
+        self.by = [tuple(keys) for keys in by]
+        self.rows = 0
+        self.names = {}
+        self.counts = {}
+        self.groups = {keys: {} for keys in self.by}
+        self.scores = {}
+
+    def add(self, table):
+        """Add the results of a ResultsTable of new rows"""
+        for judge, name in table.names.items():
+            if judge not in self.names:
+                self.names[judge] = name
+                # Earlier rows were not judged by a judge seen for the first time
+                self.counts[judge] = np.zeros(OUTCOMES, dtype=np.int64)
+                self.counts[judge][ABSENT] = self.rows
+                for groups in self.groups.values():
+                    for totals in groups.values():
+                        totals[judge] = np.zeros(OUTCOMES, dtype=np.int64)
+                        totals[judge][ABSENT] = totals["rows"]
+        self.rows += table.rows
+        for judge in self.counts:
+            if judge in table.outcomes:
+                self.counts[judge] += np.bincount(table.outcomes[judge], minlength=OUTCOMES)
+            else:
+                self.counts[judge][ABSENT] += table.rows
+        for keys in self.by:
+            group_ids, labels = table.groups(keys)
+            sizes = np.bincount(group_ids, minlength=len(labels))
+            counts = {judge: table.outcome_counts(judge, group_ids, len(labels)) for judge in table.outcomes}
+            for row, label in enumerate(labels):
+                totals = self.groups[keys].setdefault(label, {
+                    "rows": 0, **{judge: np.zeros(OUTCOMES, dtype=np.int64) for judge in self.counts}
+                })
+                totals["rows"] += int(sizes[row])
+                for judge in self.counts:
+                    if judge in counts:
+                        totals[judge] += counts[judge][row]
+                    else:
+                        totals[judge][ABSENT] += int(sizes[row])
+        for field, values in table.scores.items():
+            values = values[~np.isnan(values)]
+            if values.size:
+                stats = self.scores.setdefault(field, {"count": 0, "sum": 0.0, "squares": 0.0,
+                                                       "min": np.inf, "max": -np.inf})
+                stats["count"] += int(values.size)
+                stats["sum"] += float(values.sum())
+                stats["squares"] += float(np.square(values).sum())
+                stats["min"] = min(stats["min"], float(values.min()))
+                stats["max"] = max(stats["max"], float(values.max()))
+
+    def active_judges(self):
+        """Judges that ran on at least one item, also if every call failed, as (judge, display name)"""
+        return [(judge, name) for judge, name in self.names.items() if self.counts[judge][:ABSENT].any()]
+
+    def score_summary(self, field):
+        """Count, mean, standard deviation, minimum and maximum of a score, or None without scores"""
+        stats = self.scores.get(field)
+        if stats is None:
+            return None
+        mean = stats["sum"] / stats["count"]
+        variance = max(0.0, stats["squares"] / stats["count"] - mean * mean)
+        return {"count": stats["count"], "mean": mean, "std": variance ** 0.5, "min": stats["min"], "max": stats["max"]}
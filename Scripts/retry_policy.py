@@ -0,0 +1,189 @@
+import asyncio
+import random
+import time
+from email.utils import parsedate_to_datetime
+
+# Status codes worth retrying: timeouts, conflicts, rate limits, server errors and Anthropic's 529 "overloaded"
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504, 529}
+
+class RetryableError(Exception):
+    """A failed attempt that should be retried, e.g. a response without a usable score"""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class APIStatusError(Exception):
+    """A non-success HTTP response from an API called without an SDK"""
+
+    def __init__(self, status_code, message, headers=None):
+        super().__init__(f"HTTP {status_code}: {message}")
+        self.status_code = status_code
+        self.headers = headers or {}
+
+class RetryExhausted(Exception):
+    """Raised when a call failed fatally or ran out of attempts"""
+
+    def __init__(self, last_error, stats):
+        super().__init__(str(last_error))
+        self.last_error = last_error
+        self.stats = stats
+
+class CallStats:
+    """Retry bookkeeping for a single evaluator call"""
+
+    def __init__(self):
+        self.attempts = 0
+        self.backoff_seconds = 0.0
+        self.rate_limit_wait = 0.0
+        self.last_error = None
+
+    def as_dict(self):
+        return {
+            "attempts": self.attempts,
+            "retries": max(0, self.attempts - 1),
+            "backoff_seconds": self.backoff_seconds,
+            "rate_limit_wait": self.rate_limit_wait,
+            "error": str(self.last_error) if self.last_error is not None else None
+        }
+
+def parse_retry_after(headers):
+    """Return the server-requested delay in seconds from Retry-After style headers, or None"""
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value is not None:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def error_status_and_headers(error):
+    """Return (status code, response headers) for SDK, aiohttp and APIStatusError exceptions"""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(error, "status", None)
+    headers = getattr(error, "headers", None)
+    if headers is None:
+        response = getattr(error, "response", None)
+        headers = getattr(response, "headers", None)
+    return status, headers
+
+class RateLimiter:
+    """Client-side token bucket for one provider's requests/min and tokens/min limits.
+
+    A limit of 0 disables that bucket. Waiting callers are served in arrival order.
+    """
+
+    def __init__(self, requests_per_minute=0, tokens_per_minute=0):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        # The request bucket holds at least one request, so limits below one per minute (e.g. a small
+        # limit split across shards) still let a request through every 60 / requests_per_minute seconds
+        self.request_capacity = max(1.0, requests_per_minute) if requests_per_minute else 0.0
+        self.request_allowance = self.request_capacity
+        self.token_allowance = float(tokens_per_minute)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = asyncio.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        elapsed = now - self.updated
+        self.updated = now
+        if self.requests_per_minute:
+            self.request_allowance = min(self.request_capacity,
+                                         self.request_allowance + elapsed * self.requests_per_minute / 60)
+        if self.tokens_per_minute:
+            self.token_allowance = min(self.tokens_per_minute,
+                                       self.token_allowance + elapsed * self.tokens_per_minute / 60)
+
+    def pause(self, seconds):
+        """Hold back every caller for this provider, e.g. after a 429 with Retry-After"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    async def acquire(self, tokens=0):
+        """Wait until a request of the given token count fits in both buckets; return the time waited"""
+        waited = 0.0
+        async with self.lock:
+            while True:
+                self.refill()
+                wait = self.blocked_until - time.monotonic()
+                # A single request larger than the whole bucket is let through once the bucket is full
+                tokens_needed = min(tokens, self.tokens_per_minute)
+                if self.requests_per_minute and self.request_allowance < 1:
+                    wait = max(wait, (1 - self.request_allowance) * 60 / self.requests_per_minute)
+                if self.tokens_per_minute and self.token_allowance < tokens_needed:
+                    wait = max(wait, (tokens_needed - self.token_allowance) * 60 / self.tokens_per_minute)
+                if wait <= 0:
+                    if self.requests_per_minute:
+                        self.request_allowance -= 1
+                    if self.tokens_per_minute:
+                        self.token_allowance -= tokens_needed
+                    return waited
+                await asyncio.sleep(wait)
+                waited += wait
+
+class RetryPolicy:
+    """Exponential backoff with full jitter, Retry-After support and retryable/fatal error classification"""
+
+    def __init__(self, max_retries=10, base_delay=2.0, max_delay=60.0):
+        self.max_retries = max(1, max_retries)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def classify(self, error):
+        """Return (retryable, server-requested delay or None) for a failed attempt"""
+        if isinstance(error, RetryableError):
+            return True, error.retry_after
+        status, headers = error_status_and_headers(error)
+        if status is None:
+            # Connection errors, timeouts and malformed responses
+            return True, None
+        return status in RETRYABLE_STATUS_CODES, parse_retry_after(headers)
+
+    def backoff(self, attempt, retry_after=None):
+        """Delay before the next attempt; attempt counts from 0"""
+        if retry_after is not None:
+            # Honor the server, with a little jitter so waiting clients do not all return at once
+            return retry_after + random.uniform(0, self.base_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def run(self, attempt_call, limiter=None, tokens=0):
+        """Run attempt_call until it succeeds, fails fatally or runs out of attempts.
+
+        Returns (result, CallStats); raises RetryExhausted carrying the last error and the stats.
+        """
+        stats = CallStats()
+        for attempt in range(self.max_retries):
+            if limiter is not None:
+                stats.rate_limit_wait += await limiter.acquire(tokens)
+            stats.attempts += 1
+            try:
+                return await attempt_call(), stats
+            except Exception as e:
+                stats.last_error = e
+                retryable, retry_after = self.classify(e)
+                if not retryable or attempt == self.max_retries - 1:
+                    raise RetryExhausted(e, stats)
+                if retry_after is not None and limiter is not None:
+                    limiter.pause(retry_after)
+                delay = self.backoff(attempt, retry_after)
+                stats.backoff_seconds += delay
+                await asyncio.sleep(delay)
+        raise RetryExhausted(stats.last_error, stats)
+
+def estimate_tokens(*texts):
+    """Rough token count for rate limiting, at about four characters per token"""
+    return sum(len(text) for text in texts if text) // 4
@@ -0,0 +1,80 @@
+import asyncio
+import os
+import sys
+from result_log import item_key, read_log
+
+def parse_shard(text):
+    """Parse "i/N" into (i, N), with 0 <= i < N"""
+    try:
+        index, count = (int(part) for part in text.split("/"))
+    except ValueError:
+        raise ValueError(f"Shard must look like i/N, e.g. 0/4, not {text!r}") from None
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"Shard index must be between 0 and {count - 1}: {text!r}")
+    return index, count
+
+def item_shard(item, count):
+    """Return the shard an item belongs to; stable across runs, processes and machines"""
+    return int(item_key(item), 16) % count
+
+def shard_path(path, shard):
+    """Insert the shard into a file name: results/log.jsonl -> results/log.shard-0-of-4.jsonl"""
+    root, extension = os.path.splitext(path)
+    return f"{root}.shard-{shard[0]}-of-{shard[1]}{extension}"
+
+def merge_shard_logs(log_paths, expected_keys=None):
+    """Combine shard result logs into one list of records in dataset order.
+
+    Returns (records, report). report lists item keys found in more than one shard
+    ("duplicates", the first shard's record is kept), and, when the expected item keys are
+    given, keys with no result in any shard ("missing") and results for items that are not
+    in the dataset ("unexpected").
+    """
+    merged = {}
+    duplicates = []
+    for path in log_paths:
+        records, _ = read_log(path)
+        for key, record in records.items():
+            if key in merged:
+                duplicates.append(key)
+            else:
+                merged[key] = record
+    report = {"duplicates": duplicates, "missing": [], "unexpected": []}
+    if expected_keys is not None:
+        report["missing"] = [key for key in expected_keys if key not in merged]
+        expected = set(expected_keys)
+        report["unexpected"] = [key for key in merged if key not in expected]
+    records = sorted(merged.values(), key=lambda record: record["index"])
+    return records, report
+
+async def launch_shards(commands, output_paths):
+    """Run one shard command per process and wait for all of them.
+
+    Each process writes its output to its own file. Returns the exit codes in shard order.
+    """
+    async def run_shard(shard, command, output_path):
+        with open(output_path, "w") as output:
+            process = await asyncio.create_subprocess_exec(*command, stdout=output, stderr=asyncio.subprocess.STDOUT)
+            returncode = await process.wait()
+        print(f"Shard {shard}/{len(commands)} finished with exit code {returncode} (output in {output_path})")
+        return returncode
+
+    return await asyncio.gather(*(run_shard(shard, command, output_path)
+                                  for shard, (command, output_path) in enumerate(zip(commands, output_paths))))
+
+def strip_option(argv, option):
+    """Remove an option and its value (as "--option value" or "--option=value") from argv"""
+    stripped = []
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg == option:
+            skip = True
+        elif not arg.startswith(option + "="):
+            stripped.append(arg)
+    return stripped
+
+def shard_command(script, argv, shard):
+    """Command line for one shard process: this script's arguments plus --shard and --quiet"""
+    return [sys.executable, script, *argv, "--shard", f"{shard[0]}/{shard[1]}", "--quiet"]
@@ -1,149 +1,229 @@
-import json
-from collections import defaultdict
-
-def analyze_win_rates(data):
-    """Analyze win rate statistics"""
-    
-    # Initialize counters
-    counters = {
-        'composo_win': 0,
-        'claude_win': 0,
-        'openai_win': 0,
-        'total_comparisons': 0
-    }
-    
-    # Statistics by criterion
-    criterion_stats = defaultdict(lambda: {
-        'composo_win': 0,
-        'claude_win': 0, 
-        'openai_win': 0,
-        'total': 0
-    })
-    
-    # Statistics by datasource
-    datasource_stats = defaultdict(lambda: {
-        'composo_win': 0,
-        'claude_win': 0,
-        'openai_win': 0, 
-        'total': 0
-    })
-    
-    # Iterate through data
-    for item in data:
-        counters['total_comparisons'] += 1
-        criterion = item.get('criterion', 'unknown')
-        datasource = item.get('datasource', 'unknown')
-        
-        # Count overall win rates
-        if item.get('composo_win', False):
-            counters['composo_win'] += 1
-        if item.get('claude_win', False):
-            counters['claude_win'] += 1
-        if item.get('openai_win', False):
-            counters['openai_win'] += 1
-        
-        # Statistics by criterion
-        criterion_stats[criterion]['total'] += 1
-        if item.get('composo_win', False):
-            criterion_stats[criterion]['composo_win'] += 1
-        if item.get('claude_win', False):
-            criterion_stats[criterion]['claude_win'] += 1
-        if item.get('openai_win', False):
-            criterion_stats[criterion]['openai_win'] += 1
-            
-        # Statistics by datasource
-        datasource_stats[datasource]['total'] += 1
-        if item.get('composo_win', False):
-            datasource_stats[datasource]['composo_win'] += 1
-        if item.get('claude_win', False):
-            datasource_stats[datasource]['claude_win'] += 1
-        if item.get('openai_win', False):
-            datasource_stats[datasource]['openai_win'] += 1
-    
-    return counters, criterion_stats, datasource_stats
-
-def calculate_win_rate(wins, total):
-    """Calculate win rate percentage"""
-    return (wins / total * 100) if total > 0 else 0
-
-def print_results(counters, criterion_stats, datasource_stats):
-    """Print results"""
-    
-    total = counters['total_comparisons']
-    
+import argparse
+import os
+import sys
+import time
+from collections import deque
+import numpy as np
+from dataset_reader import detect_format
+from result_log import read_new_records
+from results_table import ResultsTable, RunningTotals, bootstrap_proportions, judge_fields
+
+def percent(value):
+    return f"{value * 100:.1f}%" if not np.isnan(value) else "-"
+
+def interval(low, high):
+    """A confidence interval as "low-high", or "-" without any decided comparisons"""
+    return f"{percent(low)}-{percent(high)}" if not np.isnan(low) else "-"
+
+def win_rate_line(name, stats, row):
+    """One judge's win rate in a group: wins over decided comparisons, ties, failures and items
+    the judge did not run on apart"""
+    wins, losses, ties, failures, absent = (int(count) for count in stats["counts"][row])
+    line = (f"{name}: {wins}/{stats['decided'][row]} ({percent(stats['rate'][row])}, "
+            f"CI {interval(stats['low'][row], stats['high'][row])})")
+    line += f", {losses} losses, {ties} ties, {failures} failed"
+    return line + f", {absent} not judged" if absent else line
+
+def print_win_rates(table, judges, by, samples, confidence, seed):
+    """Print win rates overall and per group of each key combination in by"""
+    names = dict(judges)
+    judge_keys = [judge for judge, _ in judges]
     print("=" * 60)
     print("Overall Win Rate Statistics")
     print("=" * 60)
-    print(f"Total Comparisons: {total}")
-    print(f"Composo Win Rate: {counters['composo_win']}/{total} ({calculate_win_rate(counters['composo_win'], total):.1f}%)")
-    print(f"Claude Win Rate: {counters['claude_win']}/{total} ({calculate_win_rate(counters['claude_win'], total):.1f}%)")
-    print(f"OpenAI Win Rate: {counters['openai_win']}/{total} ({calculate_win_rate(counters['openai_win'], total):.1f}%)")
-    
+    print(f"Total Comparisons: {table.rows}")
+    print(f"Win rates exclude failed judgments; intervals are {confidence * 100:.0f}% bootstrap CIs ({samples} resamples)")
+    _, overall = table.win_rates(judge_keys, (), samples, confidence, seed)
+    for judge in judge_keys:
+        print(win_rate_line(f"{names[judge]} Win Rate", overall[judge], 0))
+
+    for keys in by:
+        labels, stats = table.win_rates(judge_keys, keys, samples, confidence, seed)
+        sizes = np.bincount(table.groups(keys)[0], minlength=len(labels))
+        print("\n" + "=" * 60)
+        print(f"Statistics by {' / '.join(key.capitalize() for key in keys)}")
+        print("=" * 60)
+        for row, label in enumerate(labels):
+            print(f"\n{' / '.join(label)}:")
+            print(f"  Total: {sizes[row]}")
+            for judge in judge_keys:
+                print("  " + win_rate_line(names[judge], stats[judge], row))
+
+def print_agreement(table, judges, samples, confidence, seed):
+    """Print how often judges agree on the winner"""
+    if len(judges) < 2:
+        return
+    names = dict(judges)
     print("\n" + "=" * 60)
-    print("Statistics by Criterion")
+    print("Judge Agreement")
     print("=" * 60)
-    for criterion, stats in criterion_stats.items():
-        print(f"\n{criterion}:")
-        print(f"  Total: {stats['total']}")
-        print(f"  Composo: {stats['composo_win']}/{stats['total']} ({calculate_win_rate(stats['composo_win'], stats['total']):.1f}%)")
-        print(f"  Claude: {stats['claude_win']}/{stats['total']} ({calculate_win_rate(stats['claude_win'], stats['total']):.1f}%)")
-        print(f"  OpenAI: {stats['openai_win']}/{stats['total']} ({calculate_win_rate(stats['openai_win'], stats['total']):.1f}%)")
-    
+    for combo, agree, compared, low, high in table.agreement([judge for judge, _ in judges], samples, confidence, seed):
+        rate = agree / compared if compared else np.nan
+        label = " / ".join(names[judge] for judge in combo) if len(combo) == 2 else "All judges"
+        print(f"{label}: {agree}/{compared} ({percent(rate)}, CI {interval(low, high)})")
+
+def print_self_consistency(table, samples, confidence, seed):
+    """Print, for each self-consistency judge, how often verdicts from the first k samples match
+    the verdict from all samples, to find the smallest k that gives stable wins"""
+    if not table.samples:
+        return
     print("\n" + "=" * 60)
-    print("Statistics by Datasource")
+    print("Self-Consistency")
     print("=" * 60)
-    for datasource, stats in datasource_stats.items():
-        print(f"\n{datasource}:")
-        print(f"  Total: {stats['total']}")
-        print(f"  Composo: {stats['composo_win']}/{stats['total']} ({calculate_win_rate(stats['composo_win'], stats['total']):.1f}%)")
-        print(f"  Claude: {stats['claude_win']}/{stats['total']} ({calculate_win_rate(stats['claude_win'], stats['total']):.1f}%)")
-        print(f"  OpenAI: {stats['openai_win']}/{stats['total']} ({calculate_win_rate(stats['openai_win'], stats['total']):.1f}%)")
-
-def analyze_score_comparison(data):
-    """Analyze score comparison"""
+    rng = np.random.default_rng(seed)
+    for judge, (chosen, _, method) in table.samples.items():
+        stability = table.sample_stability(judge)
+        print(f"{table.names[judge]}: up to {chosen.shape[1]} samples per answer, {method} aggregate")
+        low, high = bootstrap_proportions([agree for _, agree, _, _, _ in stability],
+                                          [compared for _, _, compared, _, _ in stability], samples, confidence, rng)
+        for row, (k, agree, compared, tied, spread) in enumerate(stability):
+            rate = agree / compared if compared else np.nan
+            print(f"  k={k}: same verdict as all samples on {agree}/{compared} ({percent(rate)}, "
+                  f"CI {interval(low[row], high[row])}), {tied} tied, sample std {spread:.2f}")
+
+def print_score_stats(table, judges):
+    """Print the distribution of each judge's chosen and rejected scores"""
     print("\n" + "=" * 60)
     print("Score Statistics")
     print("=" * 60)
-    
-    composo_scores = []
-    chosen_openai_scores = []
-    rejected_openai_scores = []
-    chosen_claude_scores = []
-    rejected_claude_scores = []
-    
-    for item in data:
-        if 'chosen_composo' in item:
-            composo_scores.append(item['chosen_composo'])
-        if 'chosen_openai' in item:
-            chosen_openai_scores.append(item['chosen_openai'])
-        if 'rejected_openai' in item:
-            rejected_openai_scores.append(item['rejected_openai'])
-        if 'chosen_claude' in item:
-            chosen_claude_scores.append(item['chosen_claude'])
-        if 'rejected_claude' in item:
-            rejected_claude_scores.append(item['rejected_claude'])
-    
-    def print_score_stats(scores, name):
-        if scores:
-            avg = sum(scores) / len(scores)
-            min_score = min(scores)
-            max_score = max(scores)
-            print(f"{name}: Average {avg:.2f}, Min {min_score:.2f}, Max {max_score:.2f}, Sample Count {len(scores)}")
-    
-    print_score_stats(composo_scores, "Composo Scores")
-    print_score_stats(chosen_openai_scores, "OpenAI Chosen Scores")
-    print_score_stats(rejected_openai_scores, "OpenAI Rejected Scores")
-    print_score_stats(chosen_claude_scores, "Claude Chosen Scores")
-    print_score_stats(rejected_claude_scores, "Claude Rejected Scores")
+    for judge, name in judges:
+        _, chosen_field, rejected_field = judge_fields(judge)
+        for field, side in ((chosen_field, "Chosen"), (rejected_field, "Rejected")):
+            stats = table.score_summary(field)
+            if stats is not None:
+                print(f"{name} {side} Scores: Average {stats['mean']:.2f}, Std {stats['std']:.2f}, Min {stats['min']:.2f}, "
+                      f"P25 {stats['p25']:.2f}, Median {stats['median']:.2f}, P75 {stats['p75']:.2f}, "
+                      f"Max {stats['max']:.2f}, Sample Count {stats['count']}")
+
+def live_rate(name, counts, low, high):
+    """Compact win rate of one judge for the live view"""
+    decided = int(counts[:3].sum())
+    rate = counts[0] / decided if decided else np.nan
+    return f"{name} {percent(rate)} [{interval(low, high)}]"
+
+def print_live(totals, path, per_minute, samples, confidence, seed):
+    """Redraw the live view: overall and per-group win rates, and score averages"""
+    if sys.stdout.isatty():
+        print("\033[2J\033[H", end="")
+    judges = totals.active_judges()
+    rng = np.random.default_rng(seed)
+    print("=" * 60)
+    print(f"Live Results: {path}")
+    print(f"{totals.rows} results, {per_minute:.1f}/min, updated {time.strftime('%H:%M:%S')} (Ctrl+C to stop)")
+    print("=" * 60)
+    for judge, name in judges:
+        counts = totals.counts[judge]
+        (low,), (high,) = bootstrap_proportions([counts[0]], [counts[:3].sum()], samples, confidence, rng)
+        line = (f"{live_rate(name, counts, low, high)}: {counts[0]}/{counts[:3].sum()}, "
+                f"{counts[1]} losses, {counts[2]} ties, {counts[3]} failed")
+        print(line + f", {counts[4]} not judged" if counts[4] else line)
+
+    for keys in totals.by:
+        groups = totals.groups[keys]
+        print(f"\nBy {' / '.join(key.capitalize() for key in keys)}:")
+        labels = sorted(groups)
+        intervals = {}
+        for judge, _ in judges:
+            counts = np.array([groups[label][judge] for label in labels]).reshape(len(labels), -1)
+            intervals[judge] = bootstrap_proportions(counts[:, 0], counts[:, :3].sum(axis=1), samples, confidence, rng)
+        for row, label in enumerate(labels):
+            rates = [live_rate(name, groups[label][judge], intervals[judge][0][row], intervals[judge][1][row])
+                     for judge, name in judges]
+            print(f"  {' / '.join(value[:40] for value in label)} ({groups[label]['rows']}): " + ", ".join(rates))
+
+    scores = []
+    for judge, name in judges:
+        _, chosen_field, rejected_field = judge_fields(judge)
+        chosen, rejected = totals.score_summary(chosen_field), totals.score_summary(rejected_field)
+        if chosen is not None and rejected is not None:
+            scores.append(f"{name} {chosen['mean']:.2f}/{rejected['mean']:.2f}")
+    if scores:
+        print("\nAverage scores (chosen/rejected): " + ", ".join(scores))
+    sys.stdout.flush()
+
+def read_first_line(path):
+    """The first line of a result log: its run header, unique to each run that rewrote the log"""
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        return f.readline()
+
+def watch(path, by, interval, samples, confidence, seed):
+    """Follow a result log, adding only newly appended results to running totals, and redraw the
+    live view every interval seconds until interrupted"""
+    keys = list(dict.fromkeys(key for group in by for key in group))
+    totals = RunningTotals(by)
+    offset = 0
+    first_line = None
+    seen = set()
+    history = deque(maxlen=max(2, int(60 / interval) + 1))
+    try:
+        while True:
+            current_first_line = read_first_line(path)
+            if current_first_line is not None:
+                # A new run (without --resume) rewrites the log with a new run header
+                if offset and (os.path.getsize(path) < offset or current_first_line != first_line):
+                    totals, offset, seen = RunningTotals(by), 0, set()
+                    history.clear()
+                first_line = current_first_line
+            records, offset = read_new_records(path, offset)
+            # A run that started while the log was read may have mixed its records in; drop them,
+            # and the next update starts over with the new run
+            if records and read_first_line(path) != first_line:
+                records = []
+            # The same item can be logged twice if it appears twice in the dataset; count it once
+            new = []
+            for record in records:
+                if record["key"] not in seen:
+                    seen.add(record["key"])
+                    new.append(record)
+            if new:
+                totals.add(ResultsTable.from_records(new, keys))
+            history.append((time.monotonic(), totals.rows))
+            elapsed = history[-1][0] - history[0][0]
+            per_minute = (history[-1][1] - history[0][1]) / elapsed * 60 if elapsed > 0 else 0.0
+            print_live(totals, path, per_minute, samples, confidence, seed)
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        print()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Summarize evaluation results: win rates, agreement and scores")
+    parser.add_argument("--input",
+                        help="Merged results (JSON array), a result log (JSONL) or a result store directory "
+                             "(default: results/merged_evaluation.json, or results/evaluation_log.jsonl with --watch)")
+    parser.add_argument("--by", action="append",
+                        help="Result field(s) to group win rates by; combine fields with commas, e.g. datasource,criterion. "
+                             "Repeat for several groupings (default: criterion, then datasource)")
+    parser.add_argument("--bootstrap", type=int, default=1000, help="Bootstrap resamples for confidence intervals")
+    parser.add_argument("--confidence", type=float, default=0.95, help="Confidence level of the intervals")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of the bootstrap")
+    parser.add_argument("--watch", action="store_true",
+                        help="Follow a result log during a run and keep a live view of the win rates up to date")
+    parser.add_argument("--interval", type=float, default=2.0, help="Seconds between live view updates")
+    return parser.parse_args()
 
 def main():
-    
-    with open('results/merged_evaluation.json', 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    
-    counters, criterion_stats, datasource_stats = analyze_win_rates(data)
-    print_results(counters, criterion_stats, datasource_stats)
-    analyze_score_comparison(data)
+    args = parse_args()
+    by = [tuple(key.strip() for key in keys.split(",")) for keys in (args.by or ["criterion", "datasource"])]
+    keys = list(dict.fromkeys(key for group in by for key in group))
+
+    if args.watch:
+        path = args.input or "results/evaluation_log.jsonl"
+        if os.path.isdir(path) or (os.path.exists(path) and detect_format(path) == "array"):
+            raise SystemExit(f"--watch follows a result log (JSONL), not {path}")
+        watch(path, by, args.interval, args.bootstrap, args.confidence, args.seed)
+        return
+
+    started = time.monotonic()
+    table = ResultsTable.load(args.input or "results/merged_evaluation.json", keys)
+    loaded = time.monotonic()
+    judges = table.active_judges()
+    print_win_rates(table, judges, by, args.bootstrap, args.confidence, args.seed)
+    print_agreement(table, judges, args.bootstrap, args.confidence, args.seed)
+    print_self_consistency(table, args.bootstrap, args.confidence, args.seed)
+    print_score_stats(table, judges)
+    print(f"\n{table.rows} results loaded in {loaded - started:.2f}s, analyzed in {time.monotonic() - loaded:.2f}s")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,90 @@
+import asyncio
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Scripts"))
+
+from anthropic import AsyncAnthropic
+from openai import AsyncOpenAI
+from batch_engine import BatchRunner, batch_request_id
+from mock_providers import serve
+
+# Batch engine against the local stand-in providers: prepare, submit, poll and collect, a run
+# resumed from state.json after an interruption, and batches whose entries errored
+
+REQUESTS = [
+    ("anthropic", {"model": "claude-sonnet-4-20250514", "max_tokens": 100, "system": "Judge.",
+                   "messages": [{"role": "user", "content": "Rate answer one."}]}),
+    ("anthropic", {"model": "claude-sonnet-4-20250514", "max_tokens": 100, "system": "Judge.",
+                   "messages": [{"role": "user", "content": "Rate answer two."}]}),
+    ("openai", {"model": "gpt-4.1", "max_tokens": 100,
+                "messages": [{"role": "system", "content": "Judge."}, {"role": "user", "content": "Rate answer one."}]}),
+    ("openai", {"model": "gpt-4.1", "max_tokens": 100,
+                "messages": [{"role": "system", "content": "Judge."}, {"role": "user", "content": "Rate answer two."}]})
+]
+
+async def with_stand_in(scenario, **options):
+    server, url = await serve("127.0.0.1", 0, batch_delay=0.2, **options)
+    anthropic_client = AsyncAnthropic(api_key="stand-in", base_url=url)
+    openai_client = AsyncOpenAI(api_key="stand-in", base_url=f"{url}/v1")
+    try:
+        return await scenario(anthropic_client, openai_client)
+    finally:
+        await anthropic_client.close()
+        await openai_client.close()
+        await server.cleanup()
+
+def check_outputs(outputs):
+    assert set(outputs) == {batch_request_id(provider, request) for provider, request in REQUESTS}
+    for provider, request in REQUESTS:
+        output_provider, text, usage = outputs[batch_request_id(provider, request)]
+        assert output_provider == provider
+        assert "Total rating:" in text
+        assert usage is not None
+
+def test_fresh_run(tmp_path):
+    async def scenario(anthropic_client, openai_client):
+        runner = BatchRunner(anthropic_client, openai_client, work_dir=str(tmp_path), poll_interval=0.05)
+        # A duplicate request is sent once
+        return runner, await runner.run(REQUESTS + REQUESTS[:1])
+
+    runner, outputs = asyncio.run(with_stand_in(scenario))
+    check_outputs(outputs)
+    assert [batch["request_count"] for batch in runner.state["batches"]] == [2, 2]
+    assert all(batch["status"] == "downloaded" for batch in runner.state["batches"])
+
+def test_resumed_run(tmp_path):
+    async def scenario(anthropic_client, openai_client):
+        interrupted = BatchRunner(anthropic_client, openai_client, work_dir=str(tmp_path), poll_interval=0.05)
+        interrupted.prepare(REQUESTS)
+        await interrupted.submit()
+        submitted = [batch["id"] for batch in interrupted.state["batches"]]
+
+        resumed = BatchRunner(anthropic_client, openai_client, work_dir=str(tmp_path), poll_interval=0.05,
+                              resume=True)
+        outputs = await resumed.run(REQUESTS)
+        return submitted, resumed, outputs
+
+    submitted, resumed, outputs = asyncio.run(with_stand_in(scenario))
+    check_outputs(outputs)
+    # The resumed run polls the batches submitted before the interruption instead of resubmitting
+    assert [batch["id"] for batch in resumed.state["batches"]] == submitted
+    with open(tmp_path / "state.json", "r") as f:
+        state = json.load(f)
+    assert all(batch["status"] == "downloaded" for batch in state["batches"])
+
+def test_errored_entries(tmp_path):
+    async def scenario(anthropic_client, openai_client):
+        runner = BatchRunner(anthropic_client, openai_client, work_dir=str(tmp_path), poll_interval=0.05)
+        return runner, await runner.run(REQUESTS)
+
+    runner, outputs = asyncio.run(with_stand_in(scenario, error_rate=1.0))
+    # Errored entries give no outputs, so their requests fall back to interactive calls
+    assert outputs == {}
+    for batch in runner.state["batches"]:
+        assert batch["status"] == "downloaded"
+        with open(batch["output_file"], "r") as f:
+            entries = [json.loads(line) for line in f]
+        assert len(entries) == batch["request_count"]
+        assert all(entry["text"] is None and entry["error"] for entry in entries)
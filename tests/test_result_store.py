@@ -0,0 +1,47 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Scripts"))
+
+from result_log import write_results
+from result_store import ResultStore, write_store
+
+# A result store exported as JSON matches the merged results file written from the same records
+
+def make_records():
+    # Composo scores of exactly 0 or 1 are integers in the API's JSON, other scores floats
+    scores = [(0, 0.25), (1, 0.75), (0.5, 1), (0.125, 0.0), (1, 0)]
+    records = []
+    for index, (chosen, rejected) in enumerate(scores):
+        result = {
+            "prompt": f"Context {index % 2}",
+            "criterion": "Reward concise answers",
+            "chosen": f"Chosen {index}",
+            "rejected": f"Rejected {index}",
+            "datasource": "XSUM" if index % 2 else "FINQA",
+            "chosen_composo": chosen,
+            "rejected_composo": rejected,
+            "composo_win": chosen > rejected,
+            "judges": {"composo": "Composo"}
+        }
+        if index == 3:
+            result["chosen_claude"] = 71
+            result["claude_win"] = None
+        records.append({"key": f"{index:032x}", "index": index, "result": result})
+    return records
+
+def test_export_matches_merged_results(tmp_path):
+    records = make_records()
+    merged = tmp_path / "merged_evaluation.json"
+    exported = tmp_path / "exported.json"
+    write_results(records, str(merged))
+    write_store(records, str(tmp_path / "store"))
+    store = ResultStore(str(tmp_path / "store"))
+    try:
+        store.export_json(str(exported))
+        assert [store.value("chosen_composo", row) for row in range(store.rows)] == [0, 1, 0.5, 0.125, 1]
+        assert isinstance(store.value("rejected_composo", 2), int)
+        assert isinstance(store.value("rejected_composo", 3), float)
+    finally:
+        store.close()
+    assert exported.read_bytes() == merged.read_bytes()
@@ -0,0 +1,45 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Scripts"))
+
+from results_table import LOSS, TIE, WIN, ResultsTable
+
+# A majority self-consistency judge is decided by its vote, while its score columns keep the ratings
+
+def majority_result(chosen, rejected, majority, win):
+    return {
+        "criterion": "Reward concise answers",
+        "datasource": "FINQA",
+        "chosen_claude": chosen,
+        "rejected_claude": rejected,
+        "claude_aggregate": "majority",
+        "chosen_claude_samples": [20, 80, 30, 70],
+        "rejected_claude_samples": [40, 60, 40, 60],
+        "claude_majority": majority,
+        "claude_win": win,
+        "judges": {"claude": "Claude"}
+    }
+
+def test_majority_vote_decides_outcomes():
+    # Median ratings favour the chosen answer, but it won only one of four paired samples
+    records = [majority_result(50.0, 50.0, 50.0, False), majority_result(55.0, 50.0, 25.0, False),
+               majority_result(40.0, 50.0, 75.0, True)]
+    table = ResultsTable.from_records(records)
+    assert table.outcomes["claude"].tolist() == [TIE, LOSS, WIN]
+    assert table.scores["chosen_claude"].tolist() == [50.0, 55.0, 40.0]
+
+def test_stability_counts_split_votes_as_ties():
+    table = ResultsTable.from_records([majority_result(50.0, 50.0, 50.0, False)])
+    # 2 samples split 1-1, and all 4 split 2-2
+    stability = {k: (agree, compared, tied) for k, agree, compared, tied, _ in table.sample_stability("claude")}
+    assert stability[2] == (0, 0, 1)
+    assert stability[1] == (0, 1, 0)
+
+def test_split_vote_counts_as_a_tie_everywhere():
+    # evaluate.py's summary and the adaptive sampler count wins over results with a win field,
+    # so a split vote (win False) is decided but not won, as in the table's win rates
+    records = [majority_result(50.0, 50.0, 50.0, False), majority_result(40.0, 50.0, 75.0, True)]
+    _, rates = ResultsTable.from_records(records).win_rates(["claude"])
+    wins = [record["claude_win"] for record in records if record["claude_win"] is not None]
+    assert rates["claude"]["rate"][0] == sum(wins) / len(wins) == 0.5